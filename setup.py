@@ -12,7 +12,7 @@ setup(
         "python-jose[cryptography]",
         "passlib[bcrypt]",
         "python-multipart",
-        "httpx",
+        "httpx[http2]",
         "openai",
         "anthropic",
         "mistralai",
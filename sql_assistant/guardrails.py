@@ -5,10 +5,13 @@ This module provides validation and security checks for SQL queries.
 """
 import re
 import yaml
+import logging
 from typing import Tuple, Dict
 from pathlib import Path
 from .services.domain_glossary import DOMAIN_GLOSSARY
 
+logger = logging.getLogger(__name__)
+
 # Load semantic mappings
 semantic_mapping_path = Path(__file__).parent / "services" / "semantic_mapping.yaml"
 with open(semantic_mapping_path, "r", encoding="utf-8") as f:
@@ -27,6 +30,19 @@ COMMENT_PATTERNS = [
     r"/\*.*?\*/",  # Multi-line comments
 ]
 
+# Compiled once at import; validate_sql runs on every generated query
+FORBIDDEN_KEYWORD_RES = [
+    (keyword, re.compile(r'\b' + keyword + r'\b', re.IGNORECASE)) for keyword in FORBIDDEN_KEYWORDS
+]
+COMMENT_RES = [re.compile(pattern, re.IGNORECASE | re.MULTILINE | re.DOTALL) for pattern in COMMENT_PATTERNS]
+SELECT_START_RE = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+FLEET_FILTER_RE = re.compile(r'WHERE\s+.*?\bfleet_id\s*=\s*:fleet_id\b', re.IGNORECASE)
+LIMIT_VALUE_RE = re.compile(r'LIMIT\s+(\d+)', re.IGNORECASE)
+SQL_WITH_LIMIT_RE = re.compile(r"(SELECT\s+.*?LIMIT\s+\d+)(?:\s*;)?", re.IGNORECASE | re.DOTALL)
+SQL_WITH_FLEET_FILTER_RE = re.compile(
+    r"(SELECT\s+.*?WHERE\s+.*?fleet_id\s*=\s*:fleet_id\b.*)(?:;|\n\n|\Z)", re.IGNORECASE | re.DOTALL
+)
+
 with open('sql_assistant/services/business_rules.yaml', 'r', encoding='utf-8') as f:
     BUSINESS_RULES = yaml.safe_load(f)
 
@@ -158,23 +174,21 @@ def extract_sql_query(input_text: str) -> str:
     """
     # Try to find a SELECT statement with LIMIT clause
     # This pattern specifically looks for a SQL query ending with LIMIT x 
-    pattern = r"(SELECT\s+.*?LIMIT\s+\d+)(?:\s*;)?"
-    match = re.search(pattern, input_text, re.IGNORECASE | re.DOTALL)
+    match = SQL_WITH_LIMIT_RE.search(input_text)
     
     if match:
         return match.group(0).strip()
     
     # More general pattern as fallback
-    sql_pattern = r"(SELECT\s+.*?WHERE\s+.*?fleet_id\s*=\s*:fleet_id\b.*)(?:;|\n\n|\Z)"
-    match = re.search(sql_pattern, input_text, re.IGNORECASE | re.DOTALL)
+    match = SQL_WITH_FLEET_FILTER_RE.search(input_text)
     
     if match:
         # Extract the SQL query
         sql = match.group(0).strip()
         # If there's no LIMIT in the extracted SQL, it's likely incomplete
-        if not re.search(r'LIMIT\s+\d+', sql, re.IGNORECASE):
+        if not LIMIT_VALUE_RE.search(sql):
             # Try to find a LIMIT clause in the remaining text
-            limit_match = re.search(r'LIMIT\s+\d+', input_text[match.end():], re.IGNORECASE)
+            limit_match = LIMIT_VALUE_RE.search(input_text, match.end())
             if limit_match:
                 sql += " " + limit_match.group(0)
         return sql
@@ -196,30 +210,29 @@ def validate_sql(sql: str) -> Tuple[bool, str]:
     sql = str(sql).strip()
     
     # Log validation attempt
-    print(f"Validating SQL: {sql[:100]}{'...' if len(sql) > 100 else ''}")
+    logger.debug("Validating SQL: %.100s", sql)
     
     # Check for forbidden keywords
-    for keyword in FORBIDDEN_KEYWORDS:
-        pattern = r'\b' + keyword + r'\b'
-        if re.search(pattern, sql, re.IGNORECASE):
+    for keyword, keyword_re in FORBIDDEN_KEYWORD_RES:
+        if keyword_re.search(sql):
             return False, f"SQL contains forbidden keyword: {keyword}"
     
     # Check for SQL comments
-    for pattern in COMMENT_PATTERNS:
-        if re.search(pattern, sql, re.IGNORECASE | re.MULTILINE | re.DOTALL):
+    for comment_re in COMMENT_RES:
+        if comment_re.search(sql):
             return False, "SQL contains comments, which are not allowed"
     
     # Ensure query is SELECT only
-    if not re.match(r'^\s*SELECT\b', sql, re.IGNORECASE):
-        print(f"SQL validation failed: Does not start with SELECT. SQL starts with: {sql[:20]}")
+    if not SELECT_START_RE.match(sql):
+        logger.debug("SQL validation failed: Does not start with SELECT. SQL starts with: %.20s", sql)
         return False, "SQL must start with SELECT"
     
     # Ensure fleet_id filter is present
-    if not re.search(r'WHERE\s+.*?\bfleet_id\s*=\s*:fleet_id\b', sql, re.IGNORECASE):
+    if not FLEET_FILTER_RE.search(sql):
         return False, "SQL must contain WHERE clause with fleet_id = :fleet_id"
     
     # Ensure LIMIT is present and <= 5000
-    limit_match = re.search(r'LIMIT\s+(\d+)', sql, re.IGNORECASE)
+    limit_match = LIMIT_VALUE_RE.search(sql)
     if not limit_match:
         return False, "SQL must contain LIMIT clause"
     
@@ -227,7 +240,7 @@ def validate_sql(sql: str) -> Tuple[bool, str]:
     if limit_value > 5000:
         return False, f"LIMIT must be <= 5000, got {limit_value}"
     
-    print("SQL validation successful")
+    logger.debug("SQL validation successful")
     return True, ""
 
 def validate_sql_with_extraction(input_text: str) -> Tuple[bool, str, str]:
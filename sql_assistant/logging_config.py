@@ -0,0 +1,37 @@
+"""
+Logging configuration for SQL Assistant.
+
+Application log records are put on an in-memory queue and written to stderr by a
+background listener thread, so logging never blocks the event loop on I/O.
+"""
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging() -> None:
+    """Route the sql_assistant loggers through a queue to a stderr handler (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    app_logger = logging.getLogger("sql_assistant")
+    app_logger.setLevel(LOG_LEVEL)
+    app_logger.addHandler(QueueHandler(log_queue))
+    app_logger.propagate = False
+
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -4,29 +4,36 @@ Main application module for SQL Assistant.
 This module defines the FastAPI application, routes, and middleware.
 """
 import os
+import json
+import logging
 from typing import Dict
 from pathlib import Path
 from dotenv import load_dotenv
 from fastapi import FastAPI, Depends, HTTPException, Request, Body
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 
+from sql_assistant.logging_config import configure_logging
 from sql_assistant.auth import get_fleet_id, FleetMiddleware
 from sql_assistant.schemas.responses import ChatResponse
 from sql_assistant.schemas.mcp import MCPEnvelope, Step
-from sql_assistant.services.pipeline import process_query, llm_nl_to_sql, sql_exec, answer_format
+from sql_assistant.services.pipeline import process_query, process_query_stream, llm_nl_to_sql, sql_exec, answer_format, warm_db_pool
+from sql_assistant.services.llm_provider import warm_llm_connections, close_llm_http_client
 
 # Load environment variables from .env file
 load_dotenv()
+configure_logging()
+
+logger = logging.getLogger(__name__)
 
 # Get absolute path to static directory
 STATIC_DIR = Path(__file__).parent.parent / "static"
 CHAT_HTML_PATH = STATIC_DIR / "chat.html"
 
-print(f"Static directory: {STATIC_DIR}")
-print(f"Chat HTML path: {CHAT_HTML_PATH}")
-print(f"Chat HTML exists: {CHAT_HTML_PATH.exists()}")
+logger.debug("Static directory: %s", STATIC_DIR)
+logger.debug("Chat HTML path: %s (exists: %s)", CHAT_HTML_PATH, CHAT_HTML_PATH.exists())
 
 # Check if MCP is enabled
 ENABLE_MCP = os.environ.get("ENABLE_MCP", "0").lower() in ("1", "true", "yes")
@@ -69,6 +76,21 @@ async def silence_health_check_logs(request: Request, call_next):
     
     return response
 
+@app.on_event("startup")
+async def warm_up_llm_connections():
+    """Pre-establish HTTPS connections to the configured LLM providers."""
+    await warm_llm_connections()
+
+@app.on_event("startup")
+async def warm_up_db_pool():
+    """Pre-open the database connection pool."""
+    await warm_db_pool()
+
+@app.on_event("shutdown")
+async def close_llm_connections():
+    """Close pooled LLM provider connections."""
+    await close_llm_http_client()
+
 # Mount static files directory
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
@@ -114,7 +136,7 @@ async def chat(
         # Extract strategy parameter (default to 'base' if not provided)
         strategy = request.get("strategy", "base")
         
-        print(f"Chat endpoint received query: '{query}', fleet_id: {fleet_id}, strategy: {strategy}")
+        logger.debug("Chat endpoint received query: '%s', fleet_id: %s, strategy: %s", query, fleet_id, strategy)
         
         # Process query end-to-end with strategy
         result = await process_query(query, fleet_id, strategy)
@@ -129,13 +151,46 @@ async def chat(
             prompt_sql=result.get("prompt_sql"),
             prompt_answer=result.get("prompt_answer")
         )
-        print(f"Created ChatResponse with is_fallback={result['is_fallback']}")
+        logger.debug("Created ChatResponse with is_fallback=%s", result["is_fallback"])
         return response
     
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in chat endpoint: {type(e).__name__}: {str(e)}")
+        logger.error("Error in chat endpoint: %s: %s", type(e).__name__, e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream(
+    request: Dict = Body(...),
+    fleet_id: int = Depends(get_fleet_id)
+):
+    """
+    Process a natural language query and stream the answer as server-sent events.
+
+    Emits "delta" events with answer text as it is generated, then a single
+    "result" event with the same fields as the /chat response.
+    
+    Args:
+        request: Request body containing either 'query' or 'message' field
+        fleet_id: Fleet ID from JWT token
+    """
+    query = request.get("query") or request.get("message")
+    if not query:
+        raise HTTPException(status_code=400, detail="Missing 'query' or 'message' field")
+    strategy = request.get("strategy", "base")
+
+    async def event_stream():
+        async for event in process_query_stream(query, fleet_id, strategy):
+            event_type = event.pop("type")
+            yield f"event: {event_type}\ndata: {json.dumps(jsonable_encoder(event))}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # MCP Helper functions
 async def process_nl_to_sql_step(step: Step, query: str, fleet_id: int, envelope: MCPEnvelope) -> None:
     """
@@ -206,6 +261,9 @@ async def process_sql_exec_step(step: Step, query: str, fleet_id: int, envelope:
             status_code=400,
             detail="SQL step output is missing expected 'sql' field"
         )
+    except HTTPException:
+        # Re-raise HTTP exceptions (e.g. invalid fleet_id) without modification
+        raise
     except Exception as e:
         # Provide helpful context about the error
         raise HTTPException(
@@ -3,8 +3,11 @@ SQL active condition correction module.
 
 This module provides helper functions for correcting SQL queries with active conditions.
 """
+import logging
 import re
 
+logger = logging.getLogger(__name__)
+
 # SQL pattern constants to avoid duplication
 ACTIVE_VEHICLES_SQL_PATTERN = (
     "vehicles.vehicle_id IN (SELECT DISTINCT trips.vehicle_id FROM trips "
@@ -12,6 +15,13 @@ ACTIVE_VEHICLES_SQL_PATTERN = (
     "AND EXTRACT(YEAR FROM trips.start_ts) = EXTRACT(YEAR FROM CURRENT_DATE))"
 )
 
+# Compiled once at import; these run against every SQL that mentions "active"
+ACTIVE_CONDITION_RE = re.compile(r'\bactive\b\s*=\s*(true|false|1|0)', re.IGNORECASE)
+WHERE_ACTIVE_RE = re.compile(r'WHERE\b[^(]*\bactive\b\s*=\s*(true|false|1|0)', re.IGNORECASE)
+AND_ACTIVE_RE = re.compile(r'AND\b[^(]*\bactive\b\s*=\s*(true|false|1|0)', re.IGNORECASE)
+DIRECT_ACTIVE_RE = re.compile(r'active\s*=\s*(true|false|1|0)', re.IGNORECASE)
+ACTIVE_CLAUSE_RE = re.compile(r'(WHERE|AND)\b[^()]*\bactive\b[^()]*\b(AND|\)|$)', re.IGNORECASE)
+
 def detect_active_condition(sql: str) -> bool:
     """
     Detect if SQL contains an active condition.
@@ -25,8 +35,7 @@ def detect_active_condition(sql: str) -> bool:
     if "active" not in sql.lower():
         return False
     
-    active_pattern = r'\bactive\b\s*=\s*(true|false|1|0)'
-    return bool(re.search(active_pattern, sql, re.IGNORECASE))
+    return bool(ACTIVE_CONDITION_RE.search(sql))
 
 def get_activity_replacement(is_active_true: bool) -> str:
     """
@@ -56,16 +65,10 @@ def replace_where_active_clause(sql: str, activity_replacement: str) -> str:
     Returns:
         SQL with replaced WHERE clause
     """
-    where_active_pattern = r'WHERE\b[^(]*\bactive\b\s*=\s*(true|false|1|0)'
-    if re.search(where_active_pattern, sql, re.IGNORECASE):
-        print("🔄 Replacing WHERE clause with active condition")
-        return re.sub(
-            where_active_pattern,
-            f"WHERE {activity_replacement}",
-            sql,
-            flags=re.IGNORECASE
-        )
-    return sql
+    modified_sql, count = WHERE_ACTIVE_RE.subn(lambda _: f"WHERE {activity_replacement}", sql)
+    if count:
+        logger.debug("Replacing WHERE clause with active condition")
+    return modified_sql
 
 def replace_and_active_clause(sql: str, activity_replacement: str) -> str:
     """
@@ -78,16 +81,10 @@ def replace_and_active_clause(sql: str, activity_replacement: str) -> str:
     Returns:
         SQL with replaced AND clause
     """
-    and_active_pattern = r'AND\b[^(]*\bactive\b\s*=\s*(true|false|1|0)'
-    if re.search(and_active_pattern, sql, re.IGNORECASE):
-        print("🔄 Replacing AND clause with active condition")
-        return re.sub(
-            and_active_pattern,
-            f"AND {activity_replacement}",
-            sql,
-            flags=re.IGNORECASE
-        )
-    return sql
+    modified_sql, count = AND_ACTIVE_RE.subn(lambda _: f"AND {activity_replacement}", sql)
+    if count:
+        logger.debug("Replacing AND clause with active condition")
+    return modified_sql
 
 def direct_replace_active_condition(sql: str, activity_replacement: str) -> str:
     """
@@ -100,13 +97,8 @@ def direct_replace_active_condition(sql: str, activity_replacement: str) -> str:
     Returns:
         SQL with replaced active condition
     """
-    print("🔄 Direct replacement of active condition")
-    return re.sub(
-        r'active\s*=\s*(true|false|1|0)',
-        activity_replacement,
-        sql,
-        flags=re.IGNORECASE
-    )
+    logger.debug("Direct replacement of active condition")
+    return DIRECT_ACTIVE_RE.sub(lambda _: activity_replacement, sql)
 
 def handle_complex_active_clause(sql: str) -> str:
     """
@@ -118,12 +110,11 @@ def handle_complex_active_clause(sql: str) -> str:
     Returns:
         SQL with replaced active clause
     """    # Look for any WHERE/AND clauses with active
-    active_clause_pattern = r'(WHERE|AND)\b[^()]*\bactive\b[^()]*\b(AND|\)|$)'
-    match = re.search(active_clause_pattern, sql, re.IGNORECASE)
+    match = ACTIVE_CLAUSE_RE.search(sql)
     
     if match:
         activity_replacement = ACTIVE_VEHICLES_SQL_PATTERN
-        print(f"🔄 Found active clause: {match.group(0)}")
+        logger.debug("Found active clause: %s", match.group(0))
         # Replace the entire clause
         if match.group(1).upper() == "WHERE":
             replacement = f"WHERE {activity_replacement}"
@@ -170,10 +161,11 @@ def process_standard_active_condition(sql: str) -> str:
     Returns:
         Corrected SQL
     """
-    print("🔄 Found non-existent 'active' column usage")
+    logger.debug("Found non-existent 'active' column usage")
     
     # Determine if looking for active=true or active=false
-    is_active_true = "active = TRUE" in sql.upper() or "active=TRUE" in sql.upper() or "active = 1" in sql
+    match = ACTIVE_CONDITION_RE.search(sql)
+    is_active_true = match is not None and match.group(1).lower() in ("true", "1")
     
     # Get the appropriate replacement
     activity_replacement = get_activity_replacement(is_active_true)
@@ -182,7 +174,7 @@ def process_standard_active_condition(sql: str) -> str:
     for replacement_fn in [replace_where_active_clause, replace_and_active_clause, direct_replace_active_condition]:
         modified_sql = replacement_fn(sql, activity_replacement)
         if modified_sql != sql:
-            print("🔄 After active replacement: " + modified_sql[:150] + "...")
+            logger.debug("After active replacement: %.150s...", modified_sql)
             return modified_sql
     
     # No replacements made
@@ -198,13 +190,13 @@ def process_complex_active_pattern(sql: str) -> str:
     Returns:
         Corrected SQL
     """
-    print("⚠️ Found 'active' keyword but no direct match with =TRUE/FALSE pattern")
+    logger.debug("Found 'active' keyword but no direct match with =TRUE/FALSE pattern")
     
     # Try complex pattern matching
     modified_sql = handle_complex_active_clause(sql)
     
     if modified_sql != sql:
-        print("🔄 After active clause replacement: " + modified_sql[:150] + "...")
+        logger.debug("After active clause replacement: %.150s...", modified_sql)
         return modified_sql
     
     return sql
@@ -0,0 +1,177 @@
+"""
+Batch query processing for SQL Assistant.
+
+This module answers many natural language queries in one run, for offline use
+such as evaluation runs and scheduled reports. SQL generation and execution run
+concurrently, and answer formatting goes through the OpenAI Batch API, which is
+billed at half price in exchange for a completion window of up to 24 hours.
+The real-time /chat path is not affected.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, List, Tuple
+
+from sql_assistant.services.llm_provider import get_openai_client
+from sql_assistant.services.pipeline import (
+    ANSWER_MAX_TOKENS,
+    TROUBLE_MSG,
+    _coerce_fleet_id,
+    _prepare_answer_context,
+    answer_format,
+    build_answer_messages,
+    llm_nl_to_sql,
+    postprocess_answer,
+    sql_exec,
+)
+
+logger = logging.getLogger(__name__)
+
+# Batch settings
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "30"))
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_ANSWER_MODEL = "gpt-4"
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_TERMINAL_STATUSES = frozenset({"completed", "failed", "expired", "cancelled"})
+
+
+async def _prepare_batch_item(query: str, fleet_id: Any, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """
+    Generate and execute the SQL for one query and build its answer context.
+
+    An invalid fleet ID is recorded as this item's error instead of failing the batch.
+    """
+    sql = ""
+    async with semaphore:
+        try:
+            fleet_id = _coerce_fleet_id(fleet_id)
+            sql_result = await llm_nl_to_sql(query)
+            sql = sql_result["sql"]
+            exec_result = await sql_exec(sql, fleet_id)
+        except Exception as e:
+            logger.warning("SQL step failed for '%s': %s", query, e)
+            exec_result = {"rows": [], "error": f"{type(e).__name__}: {str(e)}"}
+    return {
+        "query": query,
+        "fleet_id": fleet_id,
+        "sql": sql,
+        "exec_result": exec_result,
+        "context": _prepare_answer_context(query, exec_result, sql, fleet_id=fleet_id)
+    }
+
+
+def build_batch_requests(contexts: List[str]) -> bytes:
+    """
+    Build the JSONL input file for an OpenAI answer-format batch.
+
+    Args:
+        contexts: Answer contexts, one per query
+
+    Returns:
+        JSONL file content; each request's custom_id is the index of its context
+    """
+    lines = []
+    for index, context_str in enumerate(contexts):
+        lines.append(json.dumps({
+            "custom_id": str(index),
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": BATCH_ANSWER_MODEL,
+                "messages": build_answer_messages(context_str),
+                "max_tokens": ANSWER_MAX_TOKENS
+            }
+        }))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def parse_batch_output(output: str) -> Dict[str, str]:
+    """Map custom_id to answer text for every successful request in a batch output file."""
+    answers = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        content = response["body"]["choices"][0]["message"]["content"]
+        if content:
+            answers[record["custom_id"]] = content.strip()
+    return answers
+
+
+async def _run_openai_answer_batch(contexts: List[str]) -> Dict[str, str]:
+    """Submit answer formatting as an OpenAI batch and wait for its results."""
+    client = get_openai_client()
+    input_file = await client.files.create(
+        file=("answer_format_batch.jsonl", build_batch_requests(contexts)),
+        purpose="batch"
+    )
+    batch = await client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=BATCH_COMPLETION_WINDOW
+    )
+    logger.info("Submitted OpenAI batch %s with %d requests", batch.id, len(contexts))
+    while batch.status not in BATCH_TERMINAL_STATUSES:
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        batch = await client.batches.retrieve(batch.id)
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"OpenAI batch {batch.id} ended with status '{batch.status}'")
+    output = await client.files.content(batch.output_file_id)
+    return parse_batch_output(output.text)
+
+
+async def process_queries_batch(pairs: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    """
+    Process many (query, fleet_id) pairs in one run.
+
+    Answers missing from the batch output, or all of them when no OpenAI key is
+    configured or the batch fails, are produced with the regular answer_format.
+
+    Args:
+        pairs: (natural language query, fleet ID) pairs
+
+    Returns:
+        One result dict per pair, in input order, with keys answer, sql, rows,
+        download_url and is_fallback
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    items = await asyncio.gather(*(
+        _prepare_batch_item(query, fleet_id, semaphore)
+        for query, fleet_id in pairs
+    ))
+
+    answers: Dict[str, str] = {}
+    if items and os.getenv("OPENAI_API_KEY"):
+        try:
+            answers = await _run_openai_answer_batch([item["context"] for item in items])
+        except Exception as e:
+            logger.warning("OpenAI batch failed, answering in real time: %s", e)
+
+    results = []
+    for index, item in enumerate(items):
+        answer = answers.get(str(index))
+        if answer is not None:
+            answer = postprocess_answer(answer, item["fleet_id"])
+        else:
+            try:
+                answer = await answer_format(
+                    item["query"], item["exec_result"], item["sql"],
+                    fleet_id=item["fleet_id"], context=item["context"]
+                )
+            except Exception as e:
+                logger.warning("Answer formatting failed for '%s': %s", item["query"], e)
+                answer = TROUBLE_MSG
+        exec_result = item["exec_result"]
+        results.append({
+            "answer": answer,
+            "sql": item["sql"],
+            "rows": exec_result.get("rows", []),
+            "download_url": exec_result.get("download_url", None),
+            "is_fallback": "error" in exec_result
+        })
+    return results
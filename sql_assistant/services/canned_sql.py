@@ -0,0 +1,65 @@
+"""
+Canned SQL for recurring questions.
+
+A few questions come up constantly and always map to the same query. Matching
+them here lets llm_nl_to_sql answer them without an LLM round trip. Patterns
+must match the whole (normalized) question, so anything more specific, such as
+a filter on a vehicle model, still goes to the LLM.
+"""
+import re
+from typing import Optional
+
+from sql_assistant.services.llm_cache import normalize_query
+
+# "Active this month" follows the business rule: the vehicle has a trip this month
+ACTIVE_VEHICLES_THIS_MONTH_SQL = (
+    "SELECT COUNT(DISTINCT vehicles.vehicle_id) AS active_vehicles FROM vehicles "
+    "JOIN trips ON trips.vehicle_id = vehicles.vehicle_id "
+    "WHERE vehicles.fleet_id = :fleet_id AND trips.start_ts >= date_trunc('month', CURRENT_DATE) "
+    "LIMIT 5000"
+)
+OPEN_MAINTENANCE_EVENTS_SQL = (
+    "SELECT COUNT(*) AS open_maintenance_events FROM maintenance_logs "
+    "JOIN vehicles ON vehicles.vehicle_id = maintenance_logs.vehicle_id "
+    "WHERE vehicles.fleet_id = :fleet_id AND maintenance_logs.end_ts IS NULL "
+    "LIMIT 5000"
+)
+AVG_TRIP_DISTANCE_BY_MODEL_SQL = (
+    "SELECT vehicles.model, AVG(trips.distance_km) AS avg_distance_km FROM trips "
+    "JOIN vehicles ON vehicles.vehicle_id = trips.vehicle_id "
+    "WHERE vehicles.fleet_id = :fleet_id "
+    "GROUP BY vehicles.model ORDER BY vehicles.model "
+    "LIMIT 5000"
+)
+
+# (whole-question pattern, SQL) pairs, checked in order
+CANNED_SQL = [
+    (
+        re.compile(
+            r"how many (?:vehicles|vans) (?:are )?active this month"
+            r"|how many active (?:vehicles|vans) (?:are there |do we have )?this month",
+            re.IGNORECASE
+        ),
+        ACTIVE_VEHICLES_THIS_MONTH_SQL
+    ),
+    (
+        re.compile(r"how many maintenance (?:events|jobs) are (?:still )?open", re.IGNORECASE),
+        OPEN_MAINTENANCE_EVENTS_SQL
+    ),
+    (
+        re.compile(
+            r"what is the average trip distance (?:for each|per|by) (?:vehicle )?model",
+            re.IGNORECASE
+        ),
+        AVG_TRIP_DISTANCE_BY_MODEL_SQL
+    ),
+]
+
+
+def match_canned_sql(query: str) -> Optional[str]:
+    """Return the canned SQL for a recurring question, or None if there is none."""
+    normalized = normalize_query(query)
+    for pattern, sql in CANNED_SQL:
+        if pattern.fullmatch(normalized):
+            return sql
+    return None
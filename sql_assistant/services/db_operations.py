@@ -6,23 +6,35 @@ This module provides database operations functionality for:
 2. Handling row fetching and error cases
 3. Exporting large result sets to CSV
 """
+import functools
+import logging
 import os
-import uuid
-import csv
 import re
-from typing import Dict, List, Any, Tuple, Optional, Union
+import uuid
+from typing import Any, Dict, List, Optional, Tuple, Union
+
 import sqlalchemy as sa
 from sqlalchemy.engine import Result
 from sqlalchemy.engine.row import Row
 
+logger = logging.getLogger(__name__)
+
 # Constants
-STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
+# The project-level static directory, which the app serves at /static
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "static")
 os.makedirs(STATIC_DIR, exist_ok=True)
+# Results with more rows than this are exported to CSV instead of returned inline
+LARGE_RESULT_THRESHOLD = 100
+# Distinct SQL strings whose parsed text() clause is kept for reuse
+SQL_TEXT_CACHE_SIZE = 512
 
 # Error messages
 NO_DATA_MESSAGE = "No data found for your query. Please check if there is any data in the specified time range."
 INTERNAL_ERROR_MESSAGE = "Internal error: Could not process query results. Please contact support."
 
+# PostgreSQL undefined-column error, e.g. 'column "energy" does not exist' or 'column t.energy does not exist'
+MISSING_COLUMN_RE = re.compile(r'column\s+"?([\w.]+)"?\s+does not exist', re.IGNORECASE)
+
 # Vehicle-specific error messages
 NO_VEHICLE_DATA_MESSAGE = (
     "No data found for vehicle 42 in the past 90 days. This could be because:\n"
@@ -54,7 +66,7 @@ async def _process_result(result: Result) -> Tuple[List[Dict[str, Any]], Optiona
             rows = [dict(row) for row in result.mappings()]
             return rows, None
         except Exception as e:
-            print(f"Error with result.mappings(): {str(e)}")
+            logger.warning("Error with result.mappings(): %s", e)
 
         # 2. Try result.fetchall() with row conversion
         try:
@@ -65,7 +77,7 @@ async def _process_result(result: Result) -> Tuple[List[Dict[str, Any]], Optiona
                 return [], NO_DATA_MESSAGE
             return [_row_to_dict(row) for row in rows], None
         except Exception as e:
-            print(f"Error with result.fetchall(): {str(e)}")
+            logger.warning("Error with result.fetchall(): %s", e)
 
         # 3. Try result.keys() and manual row building
         try:
@@ -79,18 +91,18 @@ async def _process_result(result: Result) -> Tuple[List[Dict[str, Any]], Optiona
                         rows.append(_row_to_dict(row))
                 return rows, None
         except Exception as e:
-            print(f"Error with result.keys(): {str(e)}")
+            logger.warning("Error with result.keys(): %s", e)
 
         # 4. Last resort: try to iterate result directly
         try:
             rows = [_row_to_dict(row) for row in result]
             return rows, None
         except Exception as e:
-            print(f"Error iterating result: {str(e)}")
+            logger.warning("Error iterating result: %s", e)
 
         return [], INTERNAL_ERROR_MESSAGE
     except Exception as e:
-        print(f"Error processing result: {str(e)}")
+        logger.warning("Error processing result: %s", e)
         return [], INTERNAL_ERROR_MESSAGE
 
 async def _try_mappings(result: Result) -> Tuple[List[Dict[str, Any]], Optional[str]]:
@@ -101,7 +113,7 @@ async def _try_mappings(result: Result) -> Tuple[List[Dict[str, Any]], Optional[
             return [], NO_VEHICLE_DATA_MESSAGE
         return rows, None
     except Exception as e:
-        print(f"Error with result.mappings(): {str(e)}")
+        logger.warning("Error with result.mappings(): %s", e)
         return [], None
 
 async def _try_fetchall(result: Result) -> Tuple[List[Dict[str, Any]], Optional[str]]:
@@ -112,7 +124,7 @@ async def _try_fetchall(result: Result) -> Tuple[List[Dict[str, Any]], Optional[
             return [], NO_VEHICLE_DATA_MESSAGE
         return [_row_to_dict(row) for row in rows], None
     except Exception as e:
-        print(f"Error with result.fetchall(): {str(e)}")
+        logger.warning("Error with result.fetchall(): %s", e)
         return [], None
 
 async def _try_keys(result: Result) -> Tuple[List[Dict[str, Any]], Optional[str]]:
@@ -131,7 +143,7 @@ async def _try_keys(result: Result) -> Tuple[List[Dict[str, Any]], Optional[str]
             return [], NO_VEHICLE_DATA_MESSAGE
         return rows, None
     except Exception as e:
-        print(f"Error with result.keys(): {str(e)}")
+        logger.warning("Error with result.keys(): %s", e)
         return [], None
 
 async def _try_iterate(result: Result) -> Tuple[List[Dict[str, Any]], Optional[str]]:
@@ -142,7 +154,7 @@ async def _try_iterate(result: Result) -> Tuple[List[Dict[str, Any]], Optional[s
             return [], NO_VEHICLE_DATA_MESSAGE
         return rows, None
     except Exception as e:
-        print(f"Error iterating result: {str(e)}")
+        logger.warning("Error iterating result: %s", e)
         return [], None
 
 async def execute_sql_query(conn, sql: str, params: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
@@ -159,9 +171,9 @@ async def execute_sql_query(conn, sql: str, params: Dict[str, Any]) -> Tuple[Lis
     """
     try:
         # Execute query
-        result = await conn.execute(sa.text(sql), params)
+        result = await conn.execute(sql_text(sql), params)
         if result is None:
-            print("Error: conn.execute() returned None")
+            logger.error("conn.execute() returned None")
             return [], "Query execution failed. Please try again."
 
         # Try different methods to get results
@@ -199,37 +211,73 @@ async def execute_sql_query(conn, sql: str, params: Dict[str, Any]) -> Tuple[Lis
 
         return [], "Could not process query results. Please try again."
     except Exception as query_error:
-        print(f"Query execution error: {str(query_error)}")
+        logger.warning("Query execution error: %s", query_error)
         return [], f"Query execution failed: {str(query_error)}"
 
-def handle_large_result(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+@functools.lru_cache(maxsize=SQL_TEXT_CACHE_SIZE)
+def sql_text(sql: str) -> sa.TextClause:
+    """Return the text() clause for a SQL string, reusing it for repeated SQL."""
+    return sa.text(sql)
+
+async def stream_sql_query(conn, sql: str, params: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Export large result sets to CSV files and return download URL.
-    
+    Execute a SQL query, returning small results inline and exporting large ones to CSV.
+
+    Rows are read from a server-side cursor. Up to LARGE_RESULT_THRESHOLD rows are
+    returned inline. Once row LARGE_RESULT_THRESHOLD + 1 arrives the cursor is
+    closed and the query runs a second time under COPY, which writes the full
+    result to a CSV download.
+
     Args:
-        rows: Query result rows
-        
+        conn: Database connection
+        sql: SQL query to execute
+        params: Query parameters
+
+    Returns:
+        {"rows": rows} for results of up to LARGE_RESULT_THRESHOLD rows, otherwise
+        {"rows": [], "row_count": n, "download_url": url}
+    """
+    result = await conn.stream(sql_text(sql), params)
+    rows = []
+    async for row in result.mappings():
+        rows.append(row)
+        if len(rows) > LARGE_RESULT_THRESHOLD:
+            await result.close()
+            return await copy_query_to_csv(conn, sql, params)
+    # Only inline rows are copied to plain dicts, for JSON serialization
+    return {"rows": [dict(row) for row in rows]}
+
+async def copy_query_to_csv(conn, sql: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Export a query's result to a CSV download with COPY ... TO STDOUT.
+
+    The server formats the CSV and asyncpg writes it straight to the file. The
+    query runs on the same connection and transaction, so the session's fleet
+    setting still applies.
+
+    Args:
+        conn: Database connection
+        sql: SQL query to export
+        params: Query parameters
+
     Returns:
         Dict with download URL and row count
     """
-    # Generate unique filename
+    # Render the named parameters as the driver's positional ones ($1, $2, ...).
+    # Only pass the ones the SQL uses: RLS already scopes queries without :fleet_id
+    compiled = sql_text(sql).compile(dialect=conn.dialect)
+    args = [params[name] for name in compiled.positiontup]
     filename = f"{uuid.uuid4()}.csv"
     filepath = os.path.join(STATIC_DIR, filename)
-    
-    # Write to CSV
-    with open(filepath, 'w', newline='') as f:
-        if rows:
-            writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-            writer.writeheader()
-            writer.writerows(rows)
-        else:
-            writer = csv.writer(f)
-            writer.writerow(["No results"])
-    
-    # Return download URL
+    raw = await conn.get_raw_connection()
+    status = await raw.driver_connection.copy_from_query(
+        compiled.string, *args, output=filepath, format="csv", header=True
+    )
+    # The command status is "COPY <rows>"
     return {
-        "download_url": f"/static/{filename}",
-        "row_count": len(rows)
+        "rows": [],
+        "row_count": int(status.split()[-1]),
+        "download_url": f"/static/{filename}"
     }
 
 def handle_column_error(bad_column: str, column_corrections: Dict[str, str]) -> Optional[str]:
@@ -259,8 +307,5 @@ def extract_bad_column(error_str: str) -> Optional[str]:
     Returns:
         Bad column name or None
     """
-    if "column" in error_str and "does not exist" in error_str:
-        column_match = re.search(r'column ([A-Za-z0-9_.]+) does not exist', error_str)
-        if column_match:
-            return column_match.group(1)
-    return None
+    column_match = MISSING_COLUMN_RE.search(error_str)
+    return column_match.group(1) if column_match else None
@@ -6,33 +6,34 @@ This module provides functionality for:
 2. Tracking error patterns
 3. Generating user-friendly error messages
 """
-import re
-import yaml
-from typing import Dict, Optional, Tuple, Any
-from datetime import datetime
-from collections import defaultdict
 import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader
+
+from sql_assistant.services.db_operations import MISSING_COLUMN_RE
+
 
 class ErrorHandler:
     def __init__(self):
-        self.error_patterns = self._load_error_patterns()
-        self.business_concepts = self._load_business_concepts()
+        config = self._load_config()
+        self.error_patterns = config.get('error_patterns', [])
+        self.business_concepts = config.get('business_concepts', {})
         self.error_stats = defaultdict(int)
         self.recent_errors = []
     
-    def _load_error_patterns(self) -> Dict[str, Any]:
-        """Load error pattern configuration"""
-        config_path = os.path.join(os.path.dirname(__file__), 'error_patterns.yaml')
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
-        return config.get('error_patterns', [])
-    
-    def _load_business_concepts(self) -> Dict[str, Any]:
-        """Load business concept configuration"""
+    def _load_config(self) -> Dict[str, Any]:
+        """Load error pattern and business concept configuration"""
         config_path = os.path.join(os.path.dirname(__file__), 'error_patterns.yaml')
         with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
-        return config.get('business_concepts', {})
+            return yaml.load(f, Loader=YamlLoader)
     
     def detect_error(self, sql: str, error_message: str) -> Tuple[str, Optional[str]]:
         """
@@ -42,11 +43,9 @@ class ErrorHandler:
             Tuple[str, Optional[str]]: (error type, corrected SQL)
         """
         # Check for missing column errors
-        if "column" in error_message.lower() and "does not exist" in error_message.lower():
-            column_match = re.search(r'column ([\w.]+) does not exist', error_message, re.IGNORECASE)
-            if column_match:
-                bad_column = column_match.group(1)
-                return self._handle_missing_column(bad_column, sql)
+        column_match = MISSING_COLUMN_RE.search(error_message)
+        if column_match:
+            return self._handle_missing_column(column_match.group(1), sql)
         
         # Check for other common mistakes
         for pattern in self.error_patterns:
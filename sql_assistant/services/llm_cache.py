@@ -0,0 +1,87 @@
+"""
+LLM response caching for SQL Assistant.
+
+This module provides in-process caches that let repeated requests skip
+LLM round trips entirely.
+"""
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# Answer cache settings
+ANSWER_CACHE_MAXSIZE = int(os.getenv("ANSWER_CACHE_MAXSIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Generated SQL cache settings
+SQL_CACHE_MAXSIZE = int(os.getenv("SQL_CACHE_MAXSIZE", "2048"))
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", "3600"))
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries expire after a fixed time-to-live."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key, or None if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entry when full."""
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Runs of whitespace, and sentence punctuation at the end of a question
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?!.。？！ "
+
+
+def normalize_query(query: str) -> str:
+    """
+    Reduce a natural language query to a cache key form.
+
+    Spacing and trailing punctuation are dropped so that "How many trips?" and
+    "How many  trips" share an entry. Case is kept, since quoted values such as
+    vehicle models are copied into the SQL as written.
+    """
+    return _WHITESPACE_RE.sub(" ", query).strip().rstrip(_TRAILING_PUNCTUATION)
+
+
+def hash_key(*parts: str) -> str:
+    """Build a compact cache key from one or more strings."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+# Answers keyed on the full answer context (query, SQL, fleet and result rows)
+answer_cache = TTLCache(ANSWER_CACHE_MAXSIZE, ANSWER_CACHE_TTL)
+# Generated SQL (and its prompt) keyed on provider, model and the user query
+sql_cache = TTLCache(SQL_CACHE_MAXSIZE, SQL_CACHE_TTL)
@@ -3,24 +3,86 @@ LLM provider utilities for SQL Assistant.
 
 This module handles interactions with different LLM providers.
 """
+import asyncio
+import functools
+import inspect
+import logging
 import os
-from typing import Dict, Tuple, Optional
-from dotenv import load_dotenv
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
 
+import anthropic
+import httpx
+import openai
+from dotenv import load_dotenv
 from fastapi import HTTPException
+from mistralai import Mistral
+from openai import AsyncOpenAI
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # API URLs for different providers
 DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
 OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
 ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
 MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
 
+DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1"
+
+# Shared HTTP client for LLM provider calls, so TCP/TLS connections are reused;
+# HTTP/2 lets concurrent calls to the same provider share one connection
+LLM_HTTP_TIMEOUT = 60.0
+LLM_WARMUP_TIMEOUT = 5.0
+LLM_HTTP_LIMITS = httpx.Limits(
+    max_keepalive_connections=40,
+    max_connections=100,
+    keepalive_expiry=30.0
+)
+_llm_http_client: Optional[httpx.AsyncClient] = None
+
+# Provider SDK clients, created once per API key: name -> (api_key, client)
+_llm_clients: Dict[str, Tuple[Optional[str], Any]] = {}
+
+# Endpoints requested at startup to establish TLS sessions before the first user query
+LLM_WARMUP_URLS = {
+    "OPENAI_API_KEY": "https://api.openai.com/v1/models",
+    "ANTHROPIC_API_KEY": "https://api.anthropic.com/v1/messages",
+    "MISTRAL_API_KEY": "https://api.mistral.ai/v1/models",
+    "DEEPSEEK_API_KEY": "https://api.deepseek.com/v1/models"
+}
+
 # Constants for error checking
 EMPTY_SQL_ERROR = "empty sql"
 BLANK_SQL_ERROR = "blank sql"
+EMPTY_SQL_ERRORS = (EMPTY_SQL_ERROR, BLANK_SQL_ERROR)
+# Returned when every provider produced empty SQL
+DEFAULT_FALLBACK_SQL = "SELECT * FROM vehicles WHERE fleet_id = :fleet_id LIMIT 100"
+
+# Retry policy for transient provider failures (rate limits, 5xx, timeouts).
+# Other 4xx errors are not retried so the caller can move on immediately.
+RETRIABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+LLM_MAX_RETRIES = 2
+LLM_RETRY_BASE_DELAY = 0.1
+LLM_RETRY_MAX_DELAY = 0.4
+# Longest Retry-After we wait out; beyond this it is cheaper to fail over
+LLM_RETRY_AFTER_MAX = 5.0
+# Overall budget for one provider call, retries included, so a slow provider
+# hands over to the next one well before the HTTP timeout
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "30"))
+
+# Per-provider throttling: concurrent requests (PROVIDER_CONCURRENCY) and
+# requests per minute (PROVIDER_RPM, unlimited when unset)
+LLM_DEFAULT_CONCURRENCY = 20
+_provider_semaphores: Dict[str, asyncio.Semaphore] = {}
+_provider_rate_limiters: Dict[str, Optional["RateLimiter"]] = {}
+
+class LLMTimeoutError(asyncio.TimeoutError):
+    """A provider call did not complete within LLM_REQUEST_TIMEOUT."""
 
 def check_llm_api_keys():
     """Check if at least one LLM API key is available."""
@@ -37,23 +99,218 @@ def check_llm_api_keys():
     
     return OPENAI_API_KEY, ANTHROPIC_API_KEY, MISTRAL_API_KEY, DEEPSEEK_API_KEY
 
+def get_llm_http_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client used for LLM provider calls."""
+    global _llm_http_client
+    if _llm_http_client is None or _llm_http_client.is_closed:
+        _llm_http_client = httpx.AsyncClient(timeout=LLM_HTTP_TIMEOUT, limits=LLM_HTTP_LIMITS, http2=True)
+    return _llm_http_client
+
+def _cached_llm_client(name: str, api_key: Optional[str], factory: Callable[[], Any]) -> Any:
+    """Return the cached SDK client for a provider, rebuilding it if the API key changed."""
+    cached = _llm_clients.get(name)
+    if cached is not None and cached[0] == api_key:
+        return cached[1]
+    client = factory()
+    _llm_clients[name] = (api_key, client)
+    return client
+
+def get_openai_client() -> AsyncOpenAI:
+    """Return the shared OpenAI client."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    return _cached_llm_client("openai", api_key, lambda: AsyncOpenAI(
+        api_key=api_key,
+        http_client=get_llm_http_client(),
+        max_retries=0
+    ))
+
+def get_deepseek_client() -> AsyncOpenAI:
+    """Return the shared DeepSeek client (OpenAI-compatible API)."""
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    return _cached_llm_client("deepseek", api_key, lambda: AsyncOpenAI(
+        api_key=api_key,
+        base_url=DEEPSEEK_BASE_URL,
+        http_client=get_llm_http_client(),
+        max_retries=0
+    ))
+
+def get_anthropic_client() -> anthropic.AsyncAnthropic:
+    """Return the shared Anthropic client."""
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    return _cached_llm_client("anthropic", api_key, lambda: anthropic.AsyncAnthropic(
+        api_key=api_key,
+        http_client=get_llm_http_client(),
+        max_retries=0
+    ))
+
+def get_mistral_client() -> Mistral:
+    """Return the shared Mistral client."""
+    api_key = os.getenv("MISTRAL_API_KEY")
+    return _cached_llm_client("mistral", api_key, lambda: Mistral(
+        api_key=api_key,
+        async_client=get_llm_http_client()
+    ))
+
+async def warm_llm_connections() -> None:
+    """
+    Open connections to every configured LLM provider ahead of the first request.
+
+    Responses and errors are ignored; the goal is only to complete the TCP and TLS
+    handshakes so the connections are already pooled when a user query arrives.
+    """
+    urls = [url for key_name, url in LLM_WARMUP_URLS.items() if os.getenv(key_name)]
+    if not urls:
+        return
+    client = get_llm_http_client()
+    await asyncio.gather(
+        *(client.head(url, timeout=LLM_WARMUP_TIMEOUT) for url in urls),
+        return_exceptions=True
+    )
+
+async def close_llm_http_client() -> None:
+    """Close the shared LLM HTTP client and drop the SDK clients built on it."""
+    global _llm_http_client
+    _llm_clients.clear()
+    if _llm_http_client is not None and not _llm_http_client.is_closed:
+        await _llm_http_client.aclose()
+    _llm_http_client = None
+
+def is_retriable_llm_error(error: Exception) -> bool:
+    """Check whether a provider error is transient and worth retrying."""
+    if isinstance(error, (
+        asyncio.TimeoutError,
+        httpx.TimeoutException,
+        openai.APIConnectionError,
+        anthropic.APIConnectionError
+    )):
+        return True
+    return getattr(error, "status_code", None) in RETRIABLE_STATUS_CODES
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read the Retry-After header from a provider error, if present."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+async def call_with_retries(call: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Call an LLM provider API with exponential backoff on transient errors.
+
+    Args:
+        call: Provider API method (sync or async)
+        *args, **kwargs: Arguments passed through to the call
+
+    Returns:
+        The provider response
+    """
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            result = call(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        except Exception as e:
+            if attempt == LLM_MAX_RETRIES or not is_retriable_llm_error(e):
+                raise
+            delay = min(LLM_RETRY_BASE_DELAY * (2 ** attempt), LLM_RETRY_MAX_DELAY)
+            retry_after = _retry_after_seconds(e)
+            if retry_after is not None:
+                if retry_after > LLM_RETRY_AFTER_MAX:
+                    raise
+                delay = max(delay, retry_after)
+            logger.info("Transient LLM error (%s), retrying in %.2fs", type(e).__name__, delay)
+            await asyncio.sleep(delay + random.uniform(0, LLM_RETRY_BASE_DELAY))
+
+class RateLimiter:
+    """Token bucket that allows `rate` acquisitions per `period` seconds."""
+
+    def __init__(self, rate: int, period: float = 60.0):
+        self.rate = rate
+        self.period = period
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.period)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.period / self.rate)
+
+def _provider_limits(provider: str) -> Tuple[asyncio.Semaphore, Optional[RateLimiter]]:
+    """Get (creating on first use) the concurrency and rate limits for a provider."""
+    semaphore = _provider_semaphores.get(provider)
+    if semaphore is None:
+        concurrency = int(os.getenv(f"{provider.upper()}_CONCURRENCY", str(LLM_DEFAULT_CONCURRENCY)))
+        semaphore = _provider_semaphores[provider] = asyncio.Semaphore(concurrency)
+    if provider not in _provider_rate_limiters:
+        rpm = os.getenv(f"{provider.upper()}_RPM")
+        _provider_rate_limiters[provider] = RateLimiter(int(rpm)) if rpm else None
+    return semaphore, _provider_rate_limiters[provider]
+
+@asynccontextmanager
+async def llm_slot(provider: str):
+    """
+    Hold one of a provider's concurrent request slots.
+
+    Bursts queue here instead of fanning out into 429s from the provider.
+    """
+    semaphore, rate_limiter = _provider_limits(provider)
+    async with semaphore:
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        yield
+
+async def call_provider(provider: str, call: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Call a provider API within its throttling limits, retrying transient errors.
+
+    The call, retries included, must finish within LLM_REQUEST_TIMEOUT (time spent
+    waiting for a throttling slot does not count).
+
+    Raises:
+        LLMTimeoutError: If the provider did not respond in time
+    """
+    async with llm_slot(provider):
+        try:
+            return await asyncio.wait_for(call_with_retries(call, *args, **kwargs), LLM_REQUEST_TIMEOUT)
+        except TimeoutError:
+            raise LLMTimeoutError(f"{provider} did not respond within {LLM_REQUEST_TIMEOUT:g}s") from None
+
 async def try_llm_provider(provider_name, provider_fn, query, fleet_id) -> Tuple[Optional[Dict[str, str]], Optional[Tuple[str, bool]]]:
     """Helper function to try an LLM provider and capture errors."""
     try:
-        print(f"Attempting SQL generation with {provider_name}")
+        logger.debug("Attempting SQL generation with %s", provider_name)
         result = await provider_fn(query, fleet_id)
         
         if not result or not result.get("sql"):
-            print(f"{provider_name} returned empty or invalid result")
+            logger.warning("%s returned empty or invalid result", provider_name)
             return None, (f"{provider_name} returned empty SQL", True)
             
         return result, None
     except Exception as e:
         error_msg = f"{provider_name} error: {str(e)}"
-        print(error_msg)
-        is_empty_error = (EMPTY_SQL_ERROR in str(e).lower() or BLANK_SQL_ERROR in str(e).lower())
+        logger.warning("%s", error_msg)
+        message = str(e).lower()
+        is_empty_error = any(token in message for token in EMPTY_SQL_ERRORS)
         return None, (error_msg, is_empty_error)
 
+@functools.cache
+def _validated_default_sql(validate_and_extract_sql_fn: Callable[[str], str]) -> str:
+    """Validate DEFAULT_FALLBACK_SQL once per validator; the input never changes."""
+    return validate_and_extract_sql_fn(DEFAULT_FALLBACK_SQL)
+
 def handle_llm_failures(errors, empty_sql_errors, validate_and_extract_sql_fn):
     """Handle the case where all LLM providers failed."""
     if not errors:
@@ -63,14 +320,14 @@ def handle_llm_failures(errors, empty_sql_errors, validate_and_extract_sql_fn):
     
     # Provide more specific error message if all LLMs returned empty SQL
     if empty_sql_errors == len(errors) and empty_sql_errors > 0:
-        print("All LLMs failed with empty SQL responses")        # Try to generate a default SQL response
+        logger.warning("All LLMs failed with empty SQL responses")
+        # Try to generate a default SQL response
         try:
-            default_sql = "SELECT * FROM vehicles WHERE fleet_id = :fleet_id LIMIT 100"
-            extracted_sql = validate_and_extract_sql_fn(default_sql)
-            print("Returning default SQL as fallback: {}".format(default_sql))
+            extracted_sql = _validated_default_sql(validate_and_extract_sql_fn)
+            logger.info("Returning default SQL as fallback: %s", extracted_sql)
             return {"sql": extracted_sql, "is_fallback": True}
         except Exception as fallback_error:
-            print("Even default SQL fallback failed: {}".format(str(fallback_error)))
+            logger.error("Even default SQL fallback failed: %s", fallback_error)
             raise HTTPException(
                 status_code=500,
                 detail="Could not generate SQL from your query. All LLM models returned empty responses. Please try reformulating your question."
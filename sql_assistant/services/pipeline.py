@@ -6,102 +6,173 @@ This module provides the core functionality for:
 2. Executing SQL queries
 3. Formatting results into human-readable answers
 """
-import os
+import asyncio
+import collections
+import functools
 import json
+import logging
+import os
 import re
-import httpx
-from typing import Dict, Optional, Any
+import time
+import traceback
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
 import yaml
-import anthropic
-from mistralai.client import MistralClient
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader
 import sqlalchemy as sa
 from dotenv import load_dotenv
+from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import create_async_engine
-from openai import AsyncOpenAI
+
+from sql_assistant.guardrails import extract_sql_query, validate_sql
 from sql_assistant.schemas.generate_sql import GenerateSQLParameters
-from sql_assistant.guardrails import validate_sql_with_extraction, extract_sql_query
+from sql_assistant.services.canned_sql import match_canned_sql
+from sql_assistant.services.db_operations import (
+    MISSING_COLUMN_RE,
+    execute_sql_query,
+    stream_sql_query,
+)
 from sql_assistant.services.domain_glossary import DOMAIN_GLOSSARY
-from sql_assistant.services.sql_correction import (
-    is_valid_sql, correct_active_conditions,
-    correct_last_active_date, ensure_trips_join, attempt_aggressive_extraction
+from sql_assistant.services.error_handler import error_handler
+from sql_assistant.services.llm_cache import (
+    answer_cache,
+    hash_key,
+    normalize_query,
+    sql_cache,
 )
 from sql_assistant.services.llm_provider import (
-    check_llm_api_keys
+    call_provider,
+    call_with_retries,
+    get_anthropic_client,
+    get_deepseek_client,
+    get_mistral_client,
+    get_openai_client,
+    llm_slot,
+)
+from sql_assistant.services.sql_correction import (
+    SELECT_RE,
+    attempt_aggressive_extraction,
+    correct_active_conditions,
+    correct_last_active_date,
+    ensure_trips_join,
+    is_valid_sql,
 )
-from sql_assistant.services.error_handler import error_handler
-from sql_assistant.services.db_operations import execute_sql_query
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Constants
 FLEET_ID_PLACEHOLDER = ":fleet_id"
-
-def _fix_vehicle_energy_usage(sql: str) -> str:
-    """Fix hallucinated vehicle_energy_usage table references."""
-    if "vehicle_energy_usage" not in sql:
-        return sql
-        
-    # Heuristically decide whether this was intended as battery health or charging info
-    if "energy_consumed" in sql or "charging" in sql:
-        sql = sql.replace("vehicle_energy_usage", "charging_sessions")
-        sql = sql.replace("timestamp", "start_ts")
-        sql = sql.replace("energy_consumed", "energy_delivered_kwh")
-    else:
-        sql = sql.replace("vehicle_energy_usage", "battery_cycles")
-        sql = sql.replace("timestamp", "ts")
-        sql = sql.replace("energy_consumed", "soh_pct")
-    return sql
-
-def _fix_last_active_date(sql: str) -> str:
-    """Fix hallucinated last_active_date column references."""
-    if "last_active_date" not in sql:
-        return sql
-        
-    sql = sql.replace("last_active_date", "t.start_ts")
-    if "FROM vehicles" in sql and "JOIN trips" not in sql:
-        sql = sql.replace("FROM vehicles", "FROM vehicles v JOIN trips t ON v.vehicle_id = t.vehicle_id")
-    if "vehicles." in sql:
-        sql = sql.replace("vehicles.", "v.")
-    return sql
-
-def _fix_datetime_columns(sql: str) -> str:
-    """Fix wrong datetime column names."""
-    return sql.replace("start_time", "start_ts").replace("end_time", "end_ts")
-
-def _fix_bad_aliases(sql: str) -> str:
-    """Fix bad table aliases."""
-    if "veu." not in sql:
-        return sql
-        
-    sql = sql.replace("veu.timestamp", "bc.ts")
-    sql = sql.replace("veu.energy_consumed", "bc.soh_pct")
-    sql = sql.replace("veu.", "bc.")
-    return sql
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "20000"))
+LIMIT_CLAUSE_RE = re.compile(r"LIMIT\s+\d+\b", re.IGNORECASE)
+LLM_LIMIT_RE = re.compile(r"\s+LIMIT\s+\d+", re.IGNORECASE)
+WHITESPACE_RE = re.compile(r"\s+")
+QUALIFIED_FIELD_RE = re.compile(r"([a-zA-Z_]+\.[a-zA-Z_]+)")
+FROM_TABLE_RE = re.compile(r"FROM\s+([a-z_]+)", re.IGNORECASE)
+# Function-call fields where the model tends to put SQL when 'sql' is empty
+SQL_FALLBACK_FIELDS = ("query", "statement", "postgresql")
+
+# Running process_query calls, keyed on (query, fleet_id, strategy)
+_inflight_queries: Dict[Tuple[str, int, str], "asyncio.Future"] = {}
+
+# LLM request hedging: the primary provider runs alone for its recent p95 latency
+# (HEDGE_DELAY until enough requests have been timed) before the others join
+HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", "2.0"))
+HEDGE_LATENCY_WINDOW = 100
+HEDGE_LATENCY_MIN_SAMPLES = 20
+_provider_latencies: Dict[Tuple[str, str], "collections.deque"] = {}
+
+# Separators for the compact JSON that goes into LLM prompts
+CONTEXT_JSON_SEPARATORS = (",", ":")
+# Bounds on the result sample included in the answer context
+ANSWER_CONTEXT_MAX_ROWS = 10
+ANSWER_CONTEXT_MAX_VALUE_CHARS = 200
+# Error messages can carry a full traceback; the first part is enough to explain them
+ANSWER_CONTEXT_MAX_ERROR_CHARS = 500
+
+# Per-request session setup: the RLS fleet id (the statement timeout is set per connection)
+SESSION_SETUP_SQL = sa.text("SELECT set_config('app.fleet_id', :fleet_id, true)")
+PING_SQL = sa.text("SELECT 1")
+
+# Hallucinated schema names and their fixes, all applied by fix_hallucinated_sql in one pass
+VEHICLE_ENERGY_USAGE_FIXES_CHARGING = {
+    "vehicle_energy_usage": "charging_sessions",
+    "timestamp": "start_ts",
+    "energy_consumed": "energy_delivered_kwh"
+}
+VEHICLE_ENERGY_USAGE_FIXES_BATTERY = {
+    "vehicle_energy_usage": "battery_cycles",
+    "timestamp": "ts",
+    "energy_consumed": "soh_pct"
+}
+LAST_ACTIVE_DATE_FIXES = {"last_active_date": "t.start_ts", "vehicles.": "v."}
+LAST_ACTIVE_DATE_JOIN = "FROM vehicles v JOIN trips t ON v.vehicle_id = t.vehicle_id"
+DATETIME_COLUMN_FIXES = {"start_time": "start_ts", "end_time": "end_ts"}
+HALLUCINATED_NAME_RE = re.compile("|".join(
+    re.escape(name) for name in sorted(
+        {*VEHICLE_ENERGY_USAGE_FIXES_CHARGING, *LAST_ACTIVE_DATE_FIXES, *DATETIME_COLUMN_FIXES,
+         "FROM vehicles", "veu.", "veu.timestamp", "veu.energy_consumed"},
+        key=len, reverse=True
+    )
+))
+# Names that make any of the fixes above applicable; most SQL contains none of them
+HALLUCINATION_TRIGGER_RE = re.compile(r"vehicle_energy_usage|last_active_date|start_time|end_time|veu\.")
+
+def _hallucination_fixes(sql: str) -> Dict[str, str]:
+    """Pick the replacements that apply to this SQL."""
+    fixes = dict(DATETIME_COLUMN_FIXES)
+    if "vehicle_energy_usage" in sql:
+        # Heuristically decide whether this was intended as battery health or charging info
+        if "energy_consumed" in sql or "charging" in sql:
+            fixes.update(VEHICLE_ENERGY_USAGE_FIXES_CHARGING)
+        else:
+            fixes.update(VEHICLE_ENERGY_USAGE_FIXES_BATTERY)
+    if "last_active_date" in sql:
+        fixes.update(LAST_ACTIVE_DATE_FIXES)
+        if "FROM vehicles" in sql and "JOIN trips" not in sql:
+            fixes["FROM vehicles"] = LAST_ACTIVE_DATE_JOIN
+    if "veu." in sql:
+        # Bad vehicle_energy_usage alias; map it to battery_cycles (bc)
+        fixes["veu."] = "bc."
+        fixes["veu.timestamp"] = "bc." + fixes.get("timestamp", "ts")
+        fixes["veu.energy_consumed"] = "bc." + fixes.get("energy_consumed", "soh_pct")
+    return fixes
 
 def _fix_duplicate_limits(sql: str) -> str:
     """Fix duplicate LIMIT clauses."""
-    if "LIMIT" not in sql.upper():
+    # Validated SQL normally carries exactly one LIMIT; stop after looking for a second
+    first_limit = LIMIT_CLAUSE_RE.search(sql)
+    if first_limit is None or LIMIT_CLAUSE_RE.search(sql, first_limit.end()) is None:
         return sql
-        
-    # Find all LIMIT clauses
-    limit_matches = re.finditer(r'LIMIT\s+(\d+)', sql, re.IGNORECASE)
-    limits = [m.group(0) for m in limit_matches]
-    
-    if len(limits) > 1:
-        # Keep the first LIMIT clause and remove others
-        keep_limit = limits[0]
-        
-        # Remove all LIMIT clauses
-        for limit in limits:
-            sql = sql.replace(limit, "")
-            
-        # Add back the first LIMIT
-        sql = sql.rstrip() + f" {keep_limit}"
-        
-        # Clean up any extra whitespace
-        sql = re.sub(r'\s+', ' ', sql).strip()
-        
-        print(f"Fixed duplicate LIMIT clauses. Keeping: {keep_limit}")
+
+    limit_matches = list(LIMIT_CLAUSE_RE.finditer(sql))
+
+    # Cut out every LIMIT clause, tidying whitespace only at the cut points,
+    # then put the first LIMIT back at the end
+    pieces = []
+    position = 0
+    for match in limit_matches:
+        pieces.append(sql[position:match.start()].strip())
+        position = match.end()
+    pieces.append(sql[position:].strip())
+    keep_limit = limit_matches[0].group(0)
+    sql = " ".join(piece for piece in pieces if piece) + f" {keep_limit}"
+    logger.debug("Fixed duplicate LIMIT clauses. Keeping: %s", keep_limit)
     return sql
 
 def fix_hallucinated_sql(sql: str) -> str:
@@ -109,11 +180,10 @@ def fix_hallucinated_sql(sql: str) -> str:
     Replace known hallucinated table/column names with valid schema names.
     Also patches incorrect aliases or date columns where necessary.
     """
-    # First fix any hallucinated tables/columns
-    sql = _fix_vehicle_energy_usage(sql)
-    sql = _fix_last_active_date(sql)
-    sql = _fix_datetime_columns(sql)
-    sql = _fix_bad_aliases(sql)
+    # First fix any hallucinated tables/columns, in a single pass over the SQL
+    if HALLUCINATION_TRIGGER_RE.search(sql):
+        fixes = _hallucination_fixes(sql)
+        sql = HALLUCINATED_NAME_RE.sub(lambda match: fixes.get(match.group(0), match.group(0)), sql)
     
     # Then fix LIMIT clauses
     sql = _fix_duplicate_limits(sql)
@@ -130,11 +200,37 @@ DB_HOST = os.getenv("DB_HOST", "db")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "sql_assistant")
 DATABASE_URL = os.getenv("DATABASE_URL", f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
-engine = create_async_engine(DATABASE_URL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+DB_POOL_RECYCLE = 300
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=DB_POOL_RECYCLE,
+    # Applied once when each connection is opened rather than on every checkout.
+    # JIT only slows down the short analytic queries and asyncpg's type introspection.
+    connect_args={
+        "server_settings": {"jit": "off", "statement_timeout": str(STATEMENT_TIMEOUT_MS)},
+        "statement_cache_size": 1024
+    }
+)
+
+async def warm_db_pool() -> None:
+    """
+    Open DB_POOL_SIZE connections ahead of the first request.
+
+    Failures are logged and ignored so the app still starts while the database is down.
+    """
+    async def _ping() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(PING_SQL)
 
-# Static directory for CSV downloads
-STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
-os.makedirs(STATIC_DIR, exist_ok=True)
+    results = await asyncio.gather(*(_ping() for _ in range(DB_POOL_SIZE)), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        logger.warning("Database pool warm-up failed for %d of %d connections: %s", len(errors), DB_POOL_SIZE, errors[0])
 
 # Load configuration files with error handling
 def load_yaml_config(filename: str, required_key: str = None) -> dict:
@@ -142,7 +238,7 @@ def load_yaml_config(filename: str, required_key: str = None) -> dict:
     filepath = os.path.join(SERVICES_DIR, filename)
     try:
         with open(filepath, 'r', encoding='utf-8') as file:
-            config = yaml.safe_load(file)
+            config = yaml.load(file, Loader=YamlLoader)
             if config is None:
                 raise ValueError(f"Empty configuration file: {filename}")
             if required_key and required_key not in config:
@@ -155,28 +251,39 @@ def load_yaml_config(filename: str, required_key: str = None) -> dict:
     except Exception as e:
         raise ValueError(f"Error loading {filename}: {str(e)}")
 
-# Load all configuration files
-try:
-    print("\n=== Loading Configuration Files ===")
-    print("Loading semantic_mapping.yaml...")
-    semantic_mappings = load_yaml_config('semantic_mapping.yaml', 'mappings')
-    print("Loading database_schema.yaml...")
-    database_schema = load_yaml_config('database_schema.yaml')
-    print("Loading business_rules.yaml...")
-    BUSINESS_RULES = load_yaml_config('business_rules.yaml')
-    print("=== Configuration Files Loaded ===\n")
-    # Configuration file assertion checks
+def _validate_config() -> None:
+    """
+    Check the shape of the loaded configuration once, at import.
+
+    The prompt formatters rely on these checks and do not repeat them.
+    """
     assert isinstance(database_schema, dict), "database_schema must be a dict, got {}".format(type(database_schema))
     assert 'tables' in database_schema and isinstance(database_schema['tables'], dict), "database_schema['tables'] must be a dict"
+    for table_name, table_info in database_schema['tables'].items():
+        assert isinstance(table_info, dict), f"Table '{table_name}' info must be a dict, got {type(table_info)}"
+        assert 'columns' in table_info and isinstance(table_info['columns'], dict), f"Table '{table_name}' must have 'columns' as dict"
+        for col_name, col_info in table_info['columns'].items():
+            assert isinstance(col_info, dict), f"Column '{col_name}' in table '{table_name}' must be a dict, got {type(col_info)}"
     assert 'critical_info' in database_schema and isinstance(database_schema['critical_info'], list), "database_schema['critical_info'] must be a list"
+    for item in database_schema['critical_info']:
+        assert isinstance(item, dict), f"Each item in critical_info must be a dict, got {type(item)}"
     assert isinstance(semantic_mappings, dict), "semantic_mappings must be a dict"
     assert isinstance(BUSINESS_RULES, dict), "BUSINESS_RULES must be a dict"
     assert 'rules' in BUSINESS_RULES and isinstance(BUSINESS_RULES['rules'], list), "BUSINESS_RULES['rules'] must be a list"
+
+# Load all configuration files
+try:
+    logger.info("Loading configuration files")
+    semantic_mappings = load_yaml_config('semantic_mapping.yaml', 'mappings')
+    database_schema = load_yaml_config('database_schema.yaml')
+    BUSINESS_RULES = load_yaml_config('business_rules.yaml')
+    logger.info("Configuration files loaded")
+    _validate_config()
 except ValueError as e:
-    print(f"Configuration error: {str(e)}")
+    logger.error("Configuration error: %s", e)
     raise
 except AssertionError as e:
-    print(f"Configuration assertion error: {str(e)}")
+    logger.error("Configuration assertion error: %s", e)
     raise
 
 # Define constants for column references
@@ -200,55 +307,104 @@ COLUMN_CORRECTIONS = {
     "temp_c": "trips.avg_temp_c",           # Common simplification
     "trip_date": "trips.start_ts::date"     # Common date extraction
 }
-
-SEMANTIC_MAPPING_YAML = 'semantic_mapping.yaml'
+# The table-qualified corrections are applied to generated SQL in one pass, longest
+# name first and whole names only (so trips.energy_kwh is left alone). Bare names
+# such as "distance" are not rewritten, since they are just as often valid aliases.
+QUALIFIED_COLUMN_CORRECTIONS = {name: fix for name, fix in COLUMN_CORRECTIONS.items() if "." in name}
+QUALIFIED_COLUMN_CORRECTION_RE = re.compile(r"\b(?:" + "|".join(
+    re.escape(name) for name in sorted(QUALIFIED_COLUMN_CORRECTIONS, key=len, reverse=True)
+) + r")\b")
 
 TROUBLE_MSG = "I'm having trouble processing your query. Could you please rephrase it?"
 
-def get_available_llm_providers():
-    providers = []
-    if os.environ.get("DEEPSEEK_API_KEY"):
-        providers.append("deepseek")
-    if os.environ.get("OPENAI_API_KEY"):
-        providers.append("openai")
-    if os.environ.get("ANTHROPIC_API_KEY"):
-        providers.append("anthropic")
-    if os.environ.get("MISTRAL_API_KEY"):
-        providers.append("mistral")
-    return providers
-
-def get_field_list_from_semantic_mapping():
-    filepath = os.path.join(SERVICES_DIR, SEMANTIC_MAPPING_YAML)
-    with open(filepath, 'r', encoding='utf-8') as f:
-        mapping = yaml.safe_load(f)
+# SQL generation models per provider: (model for simple queries, model for complex queries)
+SQL_GENERATION_MODELS = {
+    "openai": ("gpt-4o-mini", "gpt-4o"),
+    "anthropic": ("claude-3-haiku-20240307", "claude-3-opus-20240229"),
+    "mistral": ("mistral-small-latest", "mistral-large-latest"),
+    "deepseek": ("deepseek-chat", "deepseek-chat")
+}
+
+# Queries longer than this, or mentioning any of these terms, go to the stronger model
+SIMPLE_QUERY_MAX_LENGTH = 80
+COMPLEX_QUERY_KEYWORDS = (
+    "compare", "comparison", "trend", "over the past", "versus", " vs ",
+    "correlat", "rank", "percentile", "growth", "month over month", "year over year"
+)
+
+def _is_complex_query(query: str) -> bool:
+    """Cheap heuristic for whether a question needs the stronger SQL model."""
+    if len(query) > SIMPLE_QUERY_MAX_LENGTH:
+        return True
+    lowered = query.lower()
+    return any(keyword in lowered for keyword in COMPLEX_QUERY_KEYWORDS)
+
+def _pick_sql_model(provider: str, query: str) -> str:
+    """Pick the SQL generation model for a provider based on query complexity."""
+    simple_model, complex_model = SQL_GENERATION_MODELS[provider]
+    return complex_model if _is_complex_query(query) else simple_model
+
+# Providers in fallback order, with the environment variable holding each API key
+LLM_PROVIDER_KEYS = (
+    ("deepseek", "DEEPSEEK_API_KEY"),
+    ("openai", "OPENAI_API_KEY"),
+    ("anthropic", "ANTHROPIC_API_KEY"),
+    ("mistral", "MISTRAL_API_KEY"),
+)
+
+def _detect_llm_providers() -> Tuple[str, ...]:
+    return tuple(name for name, key_name in LLM_PROVIDER_KEYS if os.environ.get(key_name))
+
+# API keys don't change while the process runs, so the environment is read once
+AVAILABLE_LLM_PROVIDERS = _detect_llm_providers()
+
+def refresh_available_llm_providers() -> Tuple[str, ...]:
+    """Re-read the provider API keys from the environment (e.g. after tests change them)."""
+    global AVAILABLE_LLM_PROVIDERS
+    AVAILABLE_LLM_PROVIDERS = _detect_llm_providers()
+    return AVAILABLE_LLM_PROVIDERS
+
+def get_available_llm_providers() -> Tuple[str, ...]:
+    return AVAILABLE_LLM_PROVIDERS
+
+@functools.lru_cache(maxsize=1)
+def get_field_list_from_semantic_mapping() -> str:
+    """List the distinct table.column targets of the semantic mapping, one per line."""
     # Only take values, remove duplicates
-    fields = sorted(set(mapping['mappings'].values()))
+    fields = sorted(set(semantic_mappings.values()))
     return '\n'.join(fields)
 
-def get_semantic_mapping_prompt():
-    filepath = os.path.join(SERVICES_DIR, SEMANTIC_MAPPING_YAML)
-    with open(filepath, 'r', encoding='utf-8') as f:
-        mapping = yaml.safe_load(f)
-    lines = ["user term → table.column"]
-    lines.append("------------------------")
-    for k, v in mapping['mappings'].items():
-        lines.append(f"{k} → {v}")
-    return '\n'.join(lines), set(mapping['mappings'].values())
+# Semantic mapping prompt table and allowed table.column fields, built once from the loaded mapping
+SEMANTIC_MAPPING_TABLE = "user term → table.column\n------------------------\n" + "\n".join(
+    f"{k} → {v}" for k, v in semantic_mappings.items()
+)
+SEMANTIC_MAPPING_FIELDS = frozenset(semantic_mappings.values())
+
+def get_semantic_mapping_prompt() -> Tuple[str, frozenset]:
+    """
+    Format the semantic mapping for LLM prompts.
+
+    Returns:
+        (mapping table text, set of allowed table.column fields)
+    """
+    return SEMANTIC_MAPPING_TABLE, SEMANTIC_MAPPING_FIELDS
 
 def find_invalid_fields(sql, allowed_fields):
+    # Qualified fields need a dot; skip the regex when there is none
+    if "." not in sql:
+        return []
     # Roughly extract field names (table.column) from SQL using regex
-    used_fields = set(re.findall(r'([a-zA-Z_]+\.[a-zA-Z_]+)', sql))
-    return [f for f in used_fields if f not in allowed_fields]
+    return list(set(QUALIFIED_FIELD_RE.findall(sql)).difference(allowed_fields))
 
 def _process_sql_result(sql: str, allowed_fields, prompt, provider_idx):
     invalid_fields = find_invalid_fields(sql, allowed_fields)
     if invalid_fields:
         _, corrected_sql = error_handler.detect_error(sql, f"column {invalid_fields[0]} does not exist")
         if corrected_sql:
-            print(f"Auto-corrected SQL: {corrected_sql}")
+            logger.debug("Auto-corrected SQL: %s", corrected_sql)
             sql = corrected_sql
         else:
-            print(f"Invalid fields detected: {invalid_fields}")
+            logger.warning("Invalid fields detected: %s", invalid_fields)
             raise ValueError(f"Invalid fields in SQL: {invalid_fields}")
     return {
         "sql": sql,
@@ -259,12 +415,35 @@ def _process_sql_result(sql: str, allowed_fields, prompt, provider_idx):
 
 def _remove_llm_limits(sql: str) -> str:
     """Remove any LIMIT clauses from the SQL query."""
-    return re.sub(r'\s+LIMIT\s+\d+', '', sql, flags=re.IGNORECASE)
+    return LLM_LIMIT_RE.sub('', sql)
 
 def _add_default_limit(sql: str) -> str:
     """Add default LIMIT 5000 to SQL."""
     return sql.rstrip() + " LIMIT 5000"
 
+def _correct_sql(extracted_sql: str) -> str:
+    """Apply the schema corrections and the default LIMIT to extracted SQL."""
+    # 0. First, correct invalid column references
+    extracted_sql = _correct_invalid_columns(extracted_sql)
+    
+    # 1-2. Fix active = TRUE conditions and last_active_date references; both
+    # only apply when "active" appears, so scan the SQL for it once up front
+    if "active" in extracted_sql.lower():
+        extracted_sql = correct_active_conditions(extracted_sql)
+        extracted_sql = correct_last_active_date(extracted_sql)
+    
+    # 3. Ensure trips table is included in FROM clause if needed
+    extracted_sql = ensure_trips_join(extracted_sql)
+    
+    # 4. Fix hallucinated SQL
+    extracted_sql = fix_hallucinated_sql(extracted_sql)
+    
+    # 5. Remove any LIMITs from LLM and add our default LIMIT
+    extracted_sql = _remove_llm_limits(extracted_sql)
+    extracted_sql = _add_default_limit(extracted_sql)
+    
+    return extracted_sql
+
 def _validate_and_extract_sql(sql: str) -> str:
     """
     Validate SQL against guardrails with extraction and return the extracted SQL.
@@ -286,58 +465,40 @@ def _validate_and_extract_sql(sql: str) -> str:
     if not sql.strip():
         raise ValueError("Empty SQL response from LLM")
     
-    print("Raw LLM output received for SQL extraction: {}{}".format(
-        sql[:200], '...' if len(sql) > 200 else ''))
+    logger.debug("Raw LLM output received for SQL extraction: %.200s", sql)
     
     # First try to extract the SQL part
     extracted_sql = extract_sql_query(sql)
     if not extracted_sql:
         raise ValueError("Failed to extract SQL from LLM response")
         
-    print("Extracted SQL: {}".format(extracted_sql))
+    logger.debug("Extracted SQL: %s", extracted_sql)
     
     # Check if extraction resulted in something that looks like SQL
     if not is_valid_sql(extracted_sql):
-        print("SQL extraction failed to produce valid SQL")
+        logger.warning("SQL extraction failed to produce valid SQL")
         raise ValueError("Failed to extract valid SQL from LLM response")
     
     # SCHEMA CORRECTION: Before validation, fix common issues with the schema
-    print("Starting schema correction...")
+    logger.debug("Starting schema correction")
     original_sql = extracted_sql
     
-    # 0. First, correct invalid column references
-    extracted_sql = _correct_invalid_columns(extracted_sql)
-    
-    # 1. Fix active = TRUE conditions
-    extracted_sql = correct_active_conditions(extracted_sql)
-    
-    # 2. Fix last_active_date references
-    extracted_sql = correct_last_active_date(extracted_sql)
-    
-    # 3. Ensure trips table is included in FROM clause if needed
-    extracted_sql = ensure_trips_join(extracted_sql)
-    
-    # 4. Fix hallucinated SQL
-    extracted_sql = fix_hallucinated_sql(extracted_sql)
-    
-    # 5. Remove any LIMITs from LLM and add our default LIMIT
-    extracted_sql = _remove_llm_limits(extracted_sql)
-    extracted_sql = _add_default_limit(extracted_sql)
+    # 0-5. Correct the schema references and apply our default LIMIT
+    extracted_sql = _correct_sql(extracted_sql)
     
     # 6. Check if any modifications were made and log them
     if extracted_sql != original_sql:
-        print("✅ Schema corrections applied to the SQL query")
-        print(f"BEFORE: {original_sql}")
-        print(f"AFTER:  {extracted_sql}")
+        logger.debug("Schema corrections applied. Before: %s After: %s", original_sql, extracted_sql)
     else:
-        print("✓ No schema corrections needed")
+        logger.debug("No schema corrections needed")
     
-    # 7. Now validate SQL syntax (not schema correctness)
-    print("Validating SQL: {}".format(extracted_sql[:50] + "..."))
-    is_valid, error_message, _ = validate_sql_with_extraction(extracted_sql)
+    # 7. Now validate SQL syntax (not schema correctness); the SQL is already
+    # extracted, so validate it directly rather than extracting it again
+    logger.debug("Validating SQL: %.50s...", extracted_sql)
+    is_valid, error_message = validate_sql(extracted_sql)
     
     if not is_valid:
-        print(f"⚠️ SQL validation failed: {error_message}")
+        logger.warning("SQL validation failed: %s", error_message)
         
         # Make one more attempt with aggressive extraction
         success, extracted_try2 = attempt_aggressive_extraction(sql)
@@ -346,64 +507,115 @@ def _validate_and_extract_sql(sql: str) -> str:
             
         raise ValueError(f"Generated SQL failed validation: {error_message}")
     else:
-        print("✅ SQL validation successful")
+        logger.debug("SQL validation successful")
     
-    # 8. Final check for empty or invalid SQL
-    if not extracted_sql or not is_valid_sql(extracted_sql):
-        raise ValueError("Validation returned empty or invalid SQL")
-    
-    # 9. Always return our corrected version, not what the validator returned
-    # This ensures our schema corrections are preserved
-    print("Final SQL to be returned: " + extracted_sql[:100] + "...")
+    # 8. Return our corrected version; validate_sql has already required it to
+    # start with SELECT, so no separate emptiness check is needed
+    logger.debug("Final SQL to be returned: %.100s...", extracted_sql)
     return extracted_sql
 
 # Dictionary containing allowed column names by table
 # This helps catch references to non-existent columns
 TABLE_COLUMNS = {
-    "vehicles": ["vehicle_id", "vin", "fleet_id", "model", "make", "variant", "registration_no", "purchase_date"],
-    "trips": ["trip_id", "vehicle_id", "start_ts", "end_ts", "distance_km", "energy_kwh", "idle_minutes", "avg_temp_c"],
-    "charging_sessions": ["session_id", "vehicle_id", "start_ts", "end_ts", "start_soc", "end_soc", "energy_kwh", "location"],
-    "drivers": ["driver_id", "fleet_id", "name", "license_no", "hire_date"],
-    "fleets": ["fleet_id", "name", "country", "time_zone"],
-    "alerts": ["alert_id", "vehicle_id", "alert_type", "severity", "alert_ts", "value", "threshold", "resolved_bool", "resolved_ts"],
-    "battery_cycles": ["cycle_id", "vehicle_id", "ts", "dod_pct", "soh_pct"],
-    "raw_telemetry": ["ts", "vehicle_id", "soc_pct", "pack_voltage_v", "pack_current_a", "batt_temp_c", "latitude", "longitude", "speed_kph", "odo_km"],
-    "processed_metrics": ["ts", "vehicle_id", "avg_speed_kph_15m", "distance_km_15m", "energy_kwh_15m", "battery_health_pct", "soc_band"],
-    "maintenance_logs": ["maint_id", "vehicle_id", "maint_type", "start_ts", "end_ts", "cost_sgd", "notes"],
-    "geofence_events": ["event_id", "vehicle_id", "geofence_name", "enter_ts", "exit_ts"],
-    "fleet_daily_summary": ["fleet_id", "date", "total_distance_km", "total_energy_kwh", "active_vehicles", "avg_soc_pct"],
-    "driver_trip_map": ["trip_id", "driver_id", "primary_bool"]
+    "vehicles": frozenset({"vehicle_id", "vin", "fleet_id", "model", "make", "variant", "registration_no", "purchase_date"}),
+    "trips": frozenset({"trip_id", "vehicle_id", "start_ts", "end_ts", "distance_km", "energy_kwh", "idle_minutes", "avg_temp_c"}),
+    "charging_sessions": frozenset({"session_id", "vehicle_id", "start_ts", "end_ts", "start_soc", "end_soc", "energy_kwh", "location"}),
+    "drivers": frozenset({"driver_id", "fleet_id", "name", "license_no", "hire_date"}),
+    "fleets": frozenset({"fleet_id", "name", "country", "time_zone"}),
+    "alerts": frozenset({"alert_id", "vehicle_id", "alert_type", "severity", "alert_ts", "value", "threshold", "resolved_bool", "resolved_ts"}),
+    "battery_cycles": frozenset({"cycle_id", "vehicle_id", "ts", "dod_pct", "soh_pct"}),
+    "raw_telemetry": frozenset({"ts", "vehicle_id", "soc_pct", "pack_voltage_v", "pack_current_a", "batt_temp_c", "latitude", "longitude", "speed_kph", "odo_km"}),
+    "processed_metrics": frozenset({"ts", "vehicle_id", "avg_speed_kph_15m", "distance_km_15m", "energy_kwh_15m", "battery_health_pct", "soc_band"}),
+    "maintenance_logs": frozenset({"maint_id", "vehicle_id", "maint_type", "start_ts", "end_ts", "cost_sgd", "notes"}),
+    "geofence_events": frozenset({"event_id", "vehicle_id", "geofence_name", "enter_ts", "exit_ts"}),
+    "fleet_daily_summary": frozenset({"fleet_id", "date", "total_distance_km", "total_energy_kwh", "active_vehicles", "avg_soc_pct"}),
+    "driver_trip_map": frozenset({"trip_id", "driver_id", "primary_bool"})
+}
+
+# Column lookups for validating generated SQL: all columns, and the tables having each column
+ALL_COLUMNS = frozenset(column for columns in TABLE_COLUMNS.values() for column in columns)
+COLUMN_TABLES = {
+    column: frozenset(table for table, columns in TABLE_COLUMNS.items() if column in columns)
+    for column in ALL_COLUMNS
 }
 
+SQL_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+TABLE_ALIAS_RE = re.compile(
+    r'\b(?:FROM|JOIN)\s+([a-z_][a-z0-9_]*)(?:\s+(?:AS\s+)?([a-z_][a-z0-9_]*))?',
+    re.IGNORECASE
+)
+QUALIFIED_COLUMN_RE = re.compile(r'\b([a-z_][a-z0-9_]*)\.([a-z_][a-z0-9_]*)\b', re.IGNORECASE)
+# Words that can follow a table name but are not aliases
+NON_ALIAS_KEYWORDS = frozenset({
+    "where", "join", "left", "right", "inner", "outer", "full", "cross", "natural",
+    "on", "using", "group", "order", "having", "limit", "offset", "union",
+    "intersect", "except", "window", "lateral", "as", "and", "or", "fetch", "for"
+})
+
+class InvalidColumnError(ValueError):
+    """Raised when generated SQL references columns that do not exist in the schema."""
+
+    def __init__(self, invalid_columns):
+        self.invalid_columns = invalid_columns
+        super().__init__(f"Generated SQL references unknown columns: {', '.join(invalid_columns)}")
+
+def find_unknown_columns(sql: str) -> list:
+    """
+    Find table-qualified column references that do not exist in the schema.
+
+    Qualifiers are resolved through the table aliases declared in FROM/JOIN clauses.
+    References whose qualifier is not a known table or alias (e.g. subquery aliases)
+    are not checked.
+
+    Args:
+        sql: SQL query string
+
+    Returns:
+        Sorted list of unknown "qualifier.column" references
+    """
+    text = SQL_STRING_LITERAL_RE.sub("''", sql)
+    qualifier_tables = {}
+    for table, alias in TABLE_ALIAS_RE.findall(text):
+        table = table.lower()
+        if table not in TABLE_COLUMNS:
+            continue
+        qualifier_tables.setdefault(table, set()).add(table)
+        if alias and alias.lower() not in NON_ALIAS_KEYWORDS:
+            qualifier_tables.setdefault(alias.lower(), set()).add(table)
+
+    unknown = set()
+    for qualifier, column in QUALIFIED_COLUMN_RE.findall(text):
+        tables = qualifier_tables.get(qualifier.lower())
+        if tables is None and qualifier.lower() in TABLE_COLUMNS:
+            tables = {qualifier.lower()}
+        if not tables:
+            continue
+        if COLUMN_TABLES.get(column.lower(), frozenset()).isdisjoint(tables):
+            unknown.add(f"{qualifier}.{column}")
+    return sorted(unknown)
+
 def _format_schema_for_prompt() -> str:
     """Format database schema for LLM prompt."""
-    schema_str = "DATABASE SCHEMA:\n"
-    assert 'tables' in database_schema and isinstance(database_schema['tables'], dict), "database_schema['tables'] must be a dict"
+    parts = ["DATABASE SCHEMA:\n"]
     for table_name, table_info in database_schema['tables'].items():
-        assert isinstance(table_info, dict), f"Table '{table_name}' info must be a dict, got {type(table_info)}"
-        assert 'columns' in table_info and isinstance(table_info['columns'], dict), f"Table '{table_name}' must have 'columns' as dict"
-        schema_str += f"{table_name} table:\n"
+        parts.append(f"{table_name} table:\n")
         for col_name, col_info in table_info['columns'].items():
-            assert isinstance(col_info, dict), f"Column '{col_name}' in table '{table_name}' must be a dict, got {type(col_info)}"
             col_type = col_info['type']
             if 'example' in col_info:
-                schema_str += f"  - {col_name} ({col_type}, e.g. '{col_info['example']}')\n"
+                parts.append(f"  - {col_name} ({col_type}, e.g. '{col_info['example']}')\n")
             else:
-                schema_str += f"  - {col_name} ({col_type})\n"
-        schema_str += "\n"
-    return schema_str
+                parts.append(f"  - {col_name} ({col_type})\n")
+        parts.append("\n")
+    return "".join(parts)
 
 def _format_missing_columns(item: dict) -> str:
-    assert isinstance(item, dict), f"_format_missing_columns expects dict, got {type(item)}"
     if 'table' not in item or 'missing_columns' not in item:
         return ""
-    info_str = f"1. The {item['table']} table does NOT have these columns:\n"
-    for col in item['missing_columns']:
-        info_str += f"   - NO '{col}' column\n"
-    return info_str
+    return f"1. The {item['table']} table does NOT have these columns:\n" + "".join(
+        f"   - NO '{col}' column\n" for col in item['missing_columns']
+    )
 
 def _format_active_vehicles_pattern(item: dict) -> str:
-    assert isinstance(item, dict), f"_format_active_vehicles_pattern expects dict, got {type(item)}"
     if 'active_vehicles_pattern' not in item:
         return ""
     return (
@@ -413,7 +625,6 @@ def _format_active_vehicles_pattern(item: dict) -> str:
     )
 
 def _format_last_active_date_pattern(item: dict) -> str:
-    assert isinstance(item, dict), f"_format_last_active_date_pattern expects dict, got {type(item)}"
     if 'last_active_date_pattern' not in item:
         return ""
     return (
@@ -422,28 +633,26 @@ def _format_last_active_date_pattern(item: dict) -> str:
     )
 
 def _format_date_functions(item: dict) -> str:
-    assert isinstance(item, dict), f"_format_date_functions expects dict, got {type(item)}"
     if 'date_functions' not in item or not isinstance(item['date_functions'], dict):
         return ""
-    info_str = "\n4. Use PostgreSQL date functions, NOT MySQL functions:\n"
-    for func_name, func_pattern in item['date_functions'].items():
-        if func_name != 'forbidden':
-            info_str += f"   * For '{func_name}': {func_pattern}\n"
+    parts = ["\n4. Use PostgreSQL date functions, NOT MySQL functions:\n"]
+    parts.extend(
+        f"   * For '{func_name}': {func_pattern}\n"
+        for func_name, func_pattern in item['date_functions'].items()
+        if func_name != 'forbidden'
+    )
     if 'forbidden' in item['date_functions']:
-        info_str += f"   * Never use {', '.join(item['date_functions']['forbidden'])} syntax\n"
-    return info_str
+        parts.append(f"   * Never use {', '.join(item['date_functions']['forbidden'])} syntax\n")
+    return "".join(parts)
 
 def _format_critical_info_for_prompt() -> str:
-    assert 'critical_info' in database_schema and isinstance(database_schema['critical_info'], list), "database_schema['critical_info'] must be a list"
-    info = database_schema['critical_info']
-    info_str = "CRITICAL SCHEMA INFORMATION - READ CAREFULLY:\n"
-    for item in info:
-        assert isinstance(item, dict), f"Each item in critical_info must be a dict, got {type(item)}"
-        info_str += _format_missing_columns(item)
-        info_str += _format_active_vehicles_pattern(item)
-        info_str += _format_last_active_date_pattern(item)
-        info_str += _format_date_functions(item)
-    return info_str
+    parts = ["CRITICAL SCHEMA INFORMATION - READ CAREFULLY:\n"]
+    for item in database_schema['critical_info']:
+        parts.append(_format_missing_columns(item))
+        parts.append(_format_active_vehicles_pattern(item))
+        parts.append(_format_last_active_date_pattern(item))
+        parts.append(_format_date_functions(item))
+    return "".join(parts)
 
 def _create_prompt_framework() -> str:
     """Create the BROKE framework for prompt generation."""
@@ -482,9 +691,16 @@ Your expertise includes:
 - Better error detection and correction
 - Enhanced performance optimization"""
 
+# Prompt sections derived from the configuration loaded at import; they never change
+# at runtime, so they are rendered once here rather than for every query
+SCHEMA_PROMPT = _format_schema_for_prompt()
+CRITICAL_INFO_PROMPT = _format_critical_info_for_prompt()
+PROMPT_FRAMEWORK = _create_prompt_framework()
+BUSINESS_RULES_STR = "\n".join(BUSINESS_RULES['rules'])
+
 def _create_sql_generation_prompt() -> str:
     """Create the system prompt for SQL generation, used by all LLM providers."""
-    return f"""{_create_prompt_framework()}
+    return f"""{PROMPT_FRAMEWORK}
 
 You are a SQL expert for a fleet management system. 
             Generate PostgreSQL queries based on natural language questions.
@@ -516,9 +732,9 @@ You are a SQL expert for a fleet management system.
             4. Use consistent spacing around operators
             5. Keep line length reasonable (around 80-100 characters)
             
-{_format_schema_for_prompt()}
+{SCHEMA_PROMPT}
 
-{_format_critical_info_for_prompt()}
+{CRITICAL_INFO_PROMPT}
 
 Important rules for table and column usage:
 1. Always use the exact table names from the schema
@@ -538,17 +754,19 @@ Important rules for table and column usage:
             When interpreting the user query, use the domain glossary provided to understand 
             fleet-specific terminology and data model relationships."""
 
+# Static system prompt for SQL generation, rendered once
+SQL_GENERATION_SYSTEM_PROMPT = _create_sql_generation_prompt()
+
 def _parse_openai_function_args(function_call) -> dict:
     """Parse and validate OpenAI function call arguments."""
     if not function_call:
-        print("OpenAI response missing function call")
+        logger.warning("OpenAI response missing function call")
         raise ValueError("OpenAI response missing function call structure")
         
     try:
         return json.loads(function_call.arguments)
     except json.JSONDecodeError as e:
-        print(f"Failed to decode OpenAI function arguments: {str(e)}")
-        print(f"Raw arguments received: {function_call.arguments}")
+        logger.warning("Failed to decode OpenAI function arguments: %s; raw arguments: %s", e, function_call.arguments)
         raise ValueError(f"Invalid function arguments from OpenAI: {str(e)}")
 
 def _extract_sql_from_openai_response(function_args: dict) -> str:
@@ -557,86 +775,86 @@ def _extract_sql_from_openai_response(function_args: dict) -> str:
     
     # If SQL is empty, try to find it elsewhere in the response
     if not sql:
-        # Check if there's a query field that might contain SQL instead
-        potential_sql = function_args.get("query", "")
-        if potential_sql and "SELECT" in potential_sql.upper():
-            print(f"OpenAI returned SQL in query field instead of sql field: {potential_sql}")
-            return potential_sql
+        # Check the fields the model most often misplaces SQL into first
+        for key in SQL_FALLBACK_FIELDS:
+            value = function_args.get(key)
+            if isinstance(value, str) and SELECT_RE.search(value):
+                logger.debug("OpenAI returned SQL in %s field instead of sql field: %s", key, value)
+                return value
         
         # Check if we have other content that looks like SQL
         for key, value in function_args.items():
-            if isinstance(value, str) and "SELECT" in value.upper():
-                print(f"Found potential SQL in {key} field: {value}")
+            if key not in SQL_FALLBACK_FIELDS and isinstance(value, str) and SELECT_RE.search(value):
+                logger.debug("Found potential SQL in %s field: %s", key, value)
                 return value
     
     if not sql:
-        print(f"OpenAI returned empty SQL - function args: {function_args}")
+        logger.warning("OpenAI returned empty SQL - function args: %s", function_args)
         raise ValueError("OpenAI returned empty SQL in response")
         
     return sql
 
+SQL_PROMPT_ANTI_PATTERNS = (
+    "[Common mistakes and reasons]\n"
+    "- Mistake: Using the 'last_active_date' column (this column does not exist in the schema and cannot be used to determine activity)\n"
+    "- Mistake: Using 'status = 'active'' to determine activity (this column does not exist)\n"
+    "-- Incorrect SQL example (do NOT generate this SQL):\n"
+    "SELECT COUNT(*) FROM vehicles WHERE last_active_date >= date_trunc('month', CURRENT_DATE)  -- Incorrect, column does not exist\n"
+)
+SQL_PROMPT_EXAMPLES = (
+    "[Examples]\n"
+    "-- GOOD\n"
+    "SQL: SELECT v.vehicle_id, SUM(t.energy_kwh) AS total_energy\n"
+    "FROM vehicles v JOIN trips t ON v.vehicle_id = t.vehicle_id\n"
+    "WHERE v.fleet_id = :fleet_id\n"
+    "AND t.start_ts >= '2025-05-01' AND t.start_ts < '2025-06-01'\n"
+    "GROUP BY v.vehicle_id\n"
+    "ORDER BY total_energy DESC\n"
+    "LIMIT 3;\n\n"
+    "-- BAD\n"
+    "SQL: SELECT * FROM vehicle_energy_usage -- ❌ Table does not exist\n"
+)
+SQL_PROMPT_REQUIREMENTS = (
+    "[Requirements/Output Format]\n"
+    "1. Always include 'WHERE fleet_id = :fleet_id' in your query for security\n"
+    "2. Always include 'LIMIT 5000' at the end of your query\n"
+    "3. Only use SELECT statements, never INSERT, UPDATE, DELETE, etc.\n"
+    "4. Do not use SQL comments in your query\n"
+    "5. Return only the SQL query, nothing else - no explanations, no formatting tags\n"
+    "6. YOU MUST GENERATE A VALID PostgreSQL QUERY that starts with SELECT \n"
+    "7. DO NOT return an empty response\n"
+    "8. Use the domain glossary and semantic mapping provided above to understand fleet-specific terminology and tables\n"
+)
+
 def _build_sql_prompt(query: str) -> str:
     """Builds the full prompt for SQL generation, with BROKE at the top."""
-    mapping_table, _ = get_semantic_mapping_prompt()
-    glossary_str = glossary_to_string(DOMAIN_GLOSSARY, include_why_it_matters=True)
-    anti_pattern = (
-        "[Common mistakes and reasons]\n"
-        "- Mistake: Using the 'last_active_date' column (this column does not exist in the schema and cannot be used to determine activity)\n"
-        "- Mistake: Using 'status = 'active'' to determine activity (this column does not exist)\n"
-        "-- Incorrect SQL example (do NOT generate this SQL):\n"
-        "SELECT COUNT(*) FROM vehicles WHERE last_active_date >= date_trunc('month', CURRENT_DATE)  -- Incorrect, column does not exist\n"
-    )
-    example_block = (
-        "[Examples]\n"
-        "-- GOOD\n"
-        "SQL: SELECT v.vehicle_id, SUM(t.energy_kwh) AS total_energy\n"
-        "FROM vehicles v JOIN trips t ON v.vehicle_id = t.vehicle_id\n"
-        "WHERE v.fleet_id = :fleet_id\n"
-        "AND t.start_ts >= '2025-05-01' AND t.start_ts < '2025-06-01'\n"
-        "GROUP BY v.vehicle_id\n"
-        "ORDER BY total_energy DESC\n"
-        "LIMIT 3;\n\n"
-        "-- BAD\n"
-        "SQL: SELECT * FROM vehicle_energy_usage -- ❌ Table does not exist\n"
-    )
-    requirements = (
-        "[Requirements/Output Format]\n"
-        "1. Always include 'WHERE fleet_id = :fleet_id' in your query for security\n"
-        "2. Always include 'LIMIT 5000' at the end of your query\n"
-        "3. Only use SELECT statements, never INSERT, UPDATE, DELETE, etc.\n"
-        "4. Do not use SQL comments in your query\n"
-        "5. Return only the SQL query, nothing else - no explanations, no formatting tags\n"
-        "6. YOU MUST GENERATE A VALID PostgreSQL QUERY that starts with SELECT \n"
-        "7. DO NOT return an empty response\n"
-        "8. Use the domain glossary and semantic mapping provided above to understand fleet-specific terminology and tables\n"
-    )
-    return f"""{_create_prompt_framework()}
-
-User question: {query}
+    return f"{PROMPT_FRAMEWORK}\n\nUser question: {query}{SQL_PROMPT_BODY}"
 
-[Semantic Mapping]\n{mapping_table}\n\n[Domain Glossary]\n{glossary_str}\n\n[Critical Info]\n{_format_critical_info_for_prompt()}\n\n[Schema]\n{_format_schema_for_prompt()}\n\n{anti_pattern}\n\n{example_block}\n\n{requirements}\n"""
+ANSWER_PROMPT_REMINDER = (
+    "\n\n[Reminder to LLM: Only use columns and tables defined in the schema. "
+    "If the SQL result is empty or contains errors, analyze the reason and provide a helpful explanation to the user. "
+    "Suggest how they might rephrase their question to get the information they need.]"
+    "\n\nGiven the above context, analyze the SQL and its result. If there is an error, explain the likely cause in plain language, referencing the Domain Glossary and Business Rules as needed. Suggest how the user could rephrase or clarify their question to get a better answer."
+)
+# Shorter closing instructions for failed queries, which have no rows to describe
+ANSWER_ERROR_CONTEXT_REMINDER = (
+    "\n\n[Reminder to LLM: Mention the fleet_id in your answer. Explain the likely cause of the error in plain language "
+    "and suggest how the user could rephrase their question to get the information they need.]"
+)
 
 def _build_answer_prompt(query: str, sql_result: dict) -> str:
     """Builds the full prompt for answer explanation, with BROKE at the top."""
-    glossary_str = glossary_to_string(DOMAIN_GLOSSARY)
-    business_rules_str = "\n".join(BUSINESS_RULES['rules'])
     try:
-        context_str = json.dumps(sql_result, default=str, indent=2)
+        context_str = json.dumps(sql_result, default=str, separators=CONTEXT_JSON_SEPARATORS, ensure_ascii=False)
     except Exception:
         context_str = str(sql_result)
-    hallucination_reminder = (
-        "\n\n[Reminder to LLM: Only use columns and tables defined in the schema. "
-        "If the SQL result is empty or contains errors, analyze the reason and provide a helpful explanation to the user. "
-        "Suggest how they might rephrase their question to get the information they need.]"
-        "\n\nGiven the above context, analyze the SQL and its result. If there is an error, explain the likely cause in plain language, referencing the Domain Glossary and Business Rules as needed. Suggest how the user could rephrase or clarify their question to get a better answer."
-    )
     return (
-        f"{_create_prompt_framework()}\n"
+        f"{PROMPT_FRAMEWORK}\n"
         f"User question: {query}\n"
-        f"\nDomain Glossary:\n{glossary_str}\n"
-        f"\nBusiness Rules:\n{business_rules_str}\n"
+        f"\nDomain Glossary:\n{DOMAIN_GLOSSARY_STR}\n"
+        f"\nBusiness Rules:\n{BUSINESS_RULES_STR}\n"
         f"\nContext:\n{context_str}"
-        f"{hallucination_reminder}"
+        f"{ANSWER_PROMPT_REMINDER}"
     )
 
 def _correct_invalid_columns(sql: str) -> str:
@@ -647,9 +865,8 @@ def _correct_invalid_columns(sql: str) -> str:
     Returns:
         Corrected SQL query string
     """
-    # Example correction: Replace 'trips.energy' with 'trips.energy_kwh' in 'trips' table
-    corrected_sql = sql.replace(TRIPS_ENERGY, TRIPS_ENERGY_KWH)
-    return corrected_sql
+    # e.g. 'trips.energy' -> 'trips.energy_kwh', 'vehicle.id' -> 'vehicles.vehicle_id'
+    return QUALIFIED_COLUMN_CORRECTION_RE.sub(lambda match: QUALIFIED_COLUMN_CORRECTIONS[match.group(0)], sql)
 
 def _prepare_result_context(query: str, sql: str, sql_result: Dict[str, Any]) -> Dict[str, Any]:
     """Prepare context for LLM based on query result type."""
@@ -663,13 +880,21 @@ def _prepare_result_context(query: str, sql: str, sql_result: Dict[str, Any]) ->
             "is_empty_result": True
         }
     
-    return {
+    rows = sql_result.get("rows") or []
+    context = {
         "query": query,
         "sql": sql,
-        "row_count": len(sql_result.get("rows", [])),
-        "rows": sql_result.get("rows", [])[:10],
+        # sql_exec already reports the count; fall back to counting the rows
+        "row_count": sql_result.get("row_count") or len(rows),
+        "rows": rows[:ANSWER_CONTEXT_MAX_ROWS],
         "is_empty_result": False
     }
+    if sql_result.get("download_url"):
+        context["download_url"] = sql_result["download_url"]
+    return context
+
+# Strategies whose answers fall back to a generic query over the same table on empty results
+FALLBACK_QUERY_STRATEGIES = frozenset({"strict", "cite"})
 
 async def _handle_empty_result(query: str, sql: str, sql_result: Dict[str, Any]) -> Dict[str, Any]:
     """Handle case when query returns no results."""
@@ -677,7 +902,11 @@ async def _handle_empty_result(query: str, sql: str, sql_result: Dict[str, Any])
     if not fleet_id:
         return _prepare_result_context(query, sql, sql_result)
     
-    fallback_result = await _try_fallback_query(query, sql, fleet_id)
+    if "fallback_result" in sql_result:
+        # Already run alongside the primary query
+        fallback_result = sql_result["fallback_result"]
+    else:
+        fallback_result = await _try_fallback_query(query, sql, fleet_id)
     if not fallback_result:
         return _prepare_result_context(query, sql, sql_result)
     
@@ -689,14 +918,13 @@ async def _handle_empty_result(query: str, sql: str, sql_result: Dict[str, Any])
 
 async def _try_fallback_query(query: str, sql: str, fleet_id: int) -> Dict[str, Any]:
     """Try a more generic query when specific query returns no results."""
-    print("No results found with specific query. Trying fallback query...")
+    logger.info("Trying fallback query for: '%s'", query)
     
     # Extract the base table from the original SQL
     base_table = None
-    if "FROM" in sql.upper():
-        from_match = re.search(r'FROM\s+([a-z_]+)', sql, re.IGNORECASE)
-        if from_match:
-            base_table = from_match.group(1)
+    from_match = FROM_TABLE_RE.search(sql)
+    if from_match:
+        base_table = from_match.group(1)
     
     if not base_table:
         return None
@@ -727,59 +955,71 @@ async def _try_fallback_query(query: str, sql: str, fleet_id: int) -> Dict[str,
     except Exception:
         return None
 
-async def _safe_llm_response(context: str, providers: Dict[str, str]) -> str:
+async def _safe_llm_response(context: str) -> str:
     """Get response from the configured LLM provider."""
-    provider = get_llm_provider()
-    api_key = providers.get(provider)
+    available = get_available_llm_providers()
+    provider_names = [name for name in _provider_order() if name in available]
     
-    if not api_key or not api_key.strip():
+    if not provider_names:
         return _generate_fallback_response(context)
         
     try:
-        return await llm_answer_format(context, provider)
+        return await _first_successful_answer(context, provider_names)
     except Exception as e:
-        print(f"Error with {provider}: {str(e)}")
+        logger.error("Error with %s: %s", ", ".join(provider_names), e)
         return _generate_fallback_response(context)
 
-def _generate_fallback_response(context: str) -> str:
+# Canned answers for when no LLM provider can answer; formatted with the user query
+FALLBACK_ERROR_TEMPLATE = (
+    "I understand you're asking about {query}. "
+    "While I couldn't process this specific query, I can help you rephrase it. "
+    "Based on the error, it seems there might be an issue with how the data is being accessed. "
+    "Could you try asking your question in a different way? For example, you could:"
+    "\n1. Break down your question into simpler parts"
+    "\n2. Use more general terms from our domain glossary"
+    "\n3. Focus on specific metrics or time periods"
+)
+FALLBACK_NO_SQL_TEMPLATE = (
+    "I understand you're asking about {query}. "
+    "While I couldn't generate a specific query for this question, I can help you get the information you need. "
+    "Could you try:"
+    "\n1. Using more specific terms from our domain glossary"
+    "\n2. Breaking down your question into smaller parts"
+    "\n3. Focusing on specific metrics or time periods"
+)
+FALLBACK_GENERIC_TEMPLATE = (
+    "I understand you're asking about {query}. "
+    "While I'm having trouble processing this specific query right now, I can help you get the information you need. "
+    "Could you try rephrasing your question using terms from our domain glossary? "
+    "For example, you could ask about specific metrics like energy consumption, trip distance, or vehicle status."
+)
+# Answer contexts from _prepare_answer_context carry their JSON on the line after this marker
+ANSWER_CONTEXT_JSON_MARKER = "\nContext:\n"
+
+def _parse_answer_context(context: str) -> Dict[str, Any]:
+    """Read the JSON fields back out of an answer context string."""
+    _, marker, rest = context.rpartition(ANSWER_CONTEXT_JSON_MARKER)
+    return json.loads(rest.split("\n", 1)[0] if marker else context)
+
+def _generate_fallback_response(context: Union[str, Dict[str, Any]]) -> str:
     """Generate a fallback response when LLM is unavailable."""
     try:
-        context_dict = json.loads(context)
-        query = context_dict.get("query", "")
-        error = context_dict.get("error", "")
-        sql = context_dict.get("sql", "")
+        if isinstance(context, str):
+            context = _parse_answer_context(context)
+        query = context.get("query", "")
         
-        if error:
-            return (
-                f"I understand you're asking about {query}. "
-                f"While I couldn't process this specific query, I can help you rephrase it. "
-                f"Based on the error, it seems there might be an issue with how the data is being accessed. "
-                f"Could you try asking your question in a different way? For example, you could:"
-                f"\n1. Break down your question into simpler parts"
-                f"\n2. Use more general terms from our domain glossary"
-                f"\n3. Focus on specific metrics or time periods"
-            )
-        elif not sql:
-            return (
-                f"I understand you're asking about {query}. "
-                f"While I couldn't generate a specific query for this question, I can help you get the information you need. "
-                f"Could you try:"
-                f"\n1. Using more specific terms from our domain glossary"
-                f"\n2. Breaking down your question into smaller parts"
-                f"\n3. Focusing on specific metrics or time periods"
-            )
+        if context.get("error"):
+            template = FALLBACK_ERROR_TEMPLATE
+        elif not context.get("sql"):
+            template = FALLBACK_NO_SQL_TEMPLATE
         else:
-            return (
-                f"I understand you're asking about {query}. "
-                f"While I'm having trouble processing this specific query right now, I can help you get the information you need. "
-                f"Could you try rephrasing your question using terms from our domain glossary? "
-                f"For example, you could ask about specific metrics like energy consumption, trip distance, or vehicle status."
-            )
+            template = FALLBACK_GENERIC_TEMPLATE
+        return template.format(query=query)
     except Exception as e:
-        print(f"Error in fallback response generation: {str(e)}")
+        logger.error("Error in fallback response generation: %s", e)
         return TROUBLE_MSG
 
-async def generate_with_constraints(query: str, sql_result: Dict[str, Any], sql: str, strategy: str = "base", fleet_id: int = None) -> str:
+async def generate_with_constraints(query: str, sql_result: Dict[str, Any], sql: str, strategy: str = "base", fleet_id: int = None, prepared_context: Optional[str] = None) -> str:
     """
     Generate responses using different strategies.
     
@@ -789,16 +1029,17 @@ async def generate_with_constraints(query: str, sql_result: Dict[str, Any], sql:
         sql: SQL query that was executed
         strategy: Response generation strategy ("base", "strict", "cite")
         fleet_id: Fleet ID for filtering
+        prepared_context: Answer context already built by _prepare_answer_context, if any
         
     Returns:
         Human-readable answer formatted according to the specified strategy
     """
     try:
-        print(f"[generate_with_constraints] Using strategy: {strategy}")
+        logger.debug("Using answer strategy: %s", strategy)
         
         if strategy == "base":
             # Use the existing answer_format function for base strategy
-            return await answer_format(query, sql_result, sql, fleet_id=fleet_id)
+            return await answer_format(query, sql_result, sql, fleet_id=fleet_id, context=prepared_context)
         
         elif strategy == "strict":
             # Strict strategy: More formal, precise language with data validation
@@ -809,72 +1050,56 @@ async def generate_with_constraints(query: str, sql_result: Dict[str, Any], sql:
             return await _generate_cited_response(query, sql_result, sql, fleet_id=fleet_id)
         
         else:
-            print(f"[generate_with_constraints] Unknown strategy '{strategy}', falling back to base")
-            return await answer_format(query, sql_result, sql, fleet_id=fleet_id)
+            logger.warning("Unknown strategy '%s', falling back to base", strategy)
+            return await answer_format(query, sql_result, sql, fleet_id=fleet_id, context=prepared_context)
             
     except Exception as e:
-        print(f"Error in generate_with_constraints: {str(e)}")
+        logger.error("Error in generate_with_constraints: %s", e)
         # Fallback to base strategy
-        return await answer_format(query, sql_result, sql, fleet_id=fleet_id)
+        return await answer_format(query, sql_result, sql, fleet_id=fleet_id, context=prepared_context)
 
 async def _generate_strict_response(query: str, sql_result: Dict[str, Any], sql: str, fleet_id: int = None) -> str:
     """Generate a strict, formal response with precise language."""
     try:
         # Prepare context similar to answer_format but with strict formatting
-        if sql_result.get("is_empty_result", False) or not sql_result.get("rows"):
+        if sql_result.get("is_empty_result", False) or not (sql_result.get("rows") or sql_result.get("download_url")):
             context = await _handle_empty_result(query, sql, sql_result)
         else:
             context = _prepare_result_context(query, sql, sql_result)
         
-        OPENAI_API_KEY, ANTHROPIC_API_KEY, MISTRAL_API_KEY, DEEPSEEK_API_KEY = check_llm_api_keys()
-        providers = {
-            "openai": OPENAI_API_KEY,
-            "anthropic": ANTHROPIC_API_KEY,
-            "mistral": MISTRAL_API_KEY,
-            "deepseek": DEEPSEEK_API_KEY
-        }
-        
         # Create strict context with specific instructions
         strict_context = await _safe_context_preparation(query, context, sql)
         strict_context += "\n\nSTRICT MODE: Use formal, precise language. Include exact numbers. Avoid casual expressions. State limitations clearly."
         
-        answer = await _safe_llm_response(strict_context, providers)
+        answer = await _safe_llm_response(strict_context)
         if fleet_id is not None:
             answer = answer.replace(FLEET_ID_PLACEHOLDER, str(fleet_id))
         return answer
         
     except Exception as e:
-        print(f"Error in _generate_strict_response: {str(e)}")
+        logger.error("Error in _generate_strict_response: %s", e)
         return await answer_format(query, sql_result, sql, fleet_id=fleet_id)
 
 async def _generate_cited_response(query: str, sql_result: Dict[str, Any], sql: str, fleet_id: int = None) -> str:
     """Generate a response with citations and confidence indicators."""
     try:
         # Prepare context similar to answer_format but with citation formatting
-        if sql_result.get("is_empty_result", False) or not sql_result.get("rows"):
+        if sql_result.get("is_empty_result", False) or not (sql_result.get("rows") or sql_result.get("download_url")):
             context = await _handle_empty_result(query, sql, sql_result)
         else:
             context = _prepare_result_context(query, sql, sql_result)
         
-        OPENAI_API_KEY, ANTHROPIC_API_KEY, MISTRAL_API_KEY, DEEPSEEK_API_KEY = check_llm_api_keys()
-        providers = {
-            "openai": OPENAI_API_KEY,
-            "anthropic": ANTHROPIC_API_KEY,
-            "mistral": MISTRAL_API_KEY,
-            "deepseek": DEEPSEEK_API_KEY
-        }
-        
         # Create cited context with specific instructions
         cited_context = await _safe_context_preparation(query, context, sql)
         cited_context += "\n\nCITATION MODE: Include data sources, timestamps, and confidence indicators. Reference specific tables/columns used. Add '[Source: table_name]' citations."
         
-        answer = await _safe_llm_response(cited_context, providers)
+        answer = await _safe_llm_response(cited_context)
         if fleet_id is not None:
             answer = answer.replace(FLEET_ID_PLACEHOLDER, str(fleet_id))
         return answer
         
     except Exception as e:
-        print(f"Error in _generate_cited_response: {str(e)}")
+        logger.error("Error in _generate_cited_response: %s", e)
         return await answer_format(query, sql_result, sql, fleet_id=fleet_id)
 
 def _get_analysis_request(sql_result: dict) -> Optional[str]:
@@ -900,8 +1125,14 @@ def _add_field_info_blocks(sql_result: dict) -> str:
     return field_error_block + invalid_fields_block + suggested_fields_block
 
 def _safe_context_serialize(context: dict, query: str, sql: str, row_count: int, is_fallback: bool) -> str:
+    """
+    Serialize the answer context to compact JSON.
+
+    Compact separators and raw UTF-8 keep the prompt a fraction of the size of
+    indented, ASCII-escaped output; the LLM reads both equally well.
+    """
     try:
-        return json.dumps(context, default=str, indent=2)
+        return json.dumps(context, default=str, separators=CONTEXT_JSON_SEPARATORS, ensure_ascii=False)
     except Exception:
         context = {
             "query": query,
@@ -914,11 +1145,41 @@ def _safe_context_serialize(context: dict, query: str, sql: str, row_count: int,
                 "Focus on suggesting how they might rephrase their question."
             )
         }
-        return json.dumps(context, default=str, indent=2)
+        return json.dumps(context, default=str, separators=CONTEXT_JSON_SEPARATORS, ensure_ascii=False)
+
+def _compact_context_value(value: Any) -> Any:
+    """Replace binary and overly long values with short placeholders for the LLM."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str) and len(value) > ANSWER_CONTEXT_MAX_VALUE_CHARS:
+        return value[:ANSWER_CONTEXT_MAX_VALUE_CHARS] + f"... <{len(value)} chars>"
+    return value
+
+def _sample_rows_for_context(rows: List[Any]) -> List[Any]:
+    """Take the leading rows of a result, with wide values shortened, before serialization."""
+    sample = []
+    for row in rows[:ANSWER_CONTEXT_MAX_ROWS]:
+        if isinstance(row, dict):
+            row = {key: _compact_context_value(value) for key, value in row.items()}
+        sample.append(row)
+    return sample
+
+# Closing instructions appended to every answer context
+ANSWER_CONTEXT_REMINDER = (
+    "\n\nWhen explaining results or errors, use the Domain Glossary to clarify terms, and refer to the Business Rules to guide your suggestions."
+    "\n\n[Reminder to LLM: Always mention the fleet_id (and fleet name if available) in your answer, so the user knows which fleet the data refers to. "
+    "Only use columns and tables defined in the schema. If the SQL result is empty or contains errors, analyze the reason and provide a helpful explanation to the user. "
+    "Suggest how they might rephrase their question to get the information they need.]"
+    "\n\nGiven the above context, analyze the SQL and its result. If there is an error, explain the likely cause in plain language, referencing the Domain Glossary and Business Rules as needed. Suggest how the user could rephrase or clarify their question to get a better answer."
+)
+
 
 def _prepare_answer_context(query: str, sql_result: Dict[str, Any], sql: str, fleet_id: Optional[int] = None, fleet_name: Optional[str] = None) -> str:
     """
     Prepare context for answer formatting.
+
+    Failed queries get a shorter closing reminder and a truncated error message,
+    since there are no rows to describe and tracebacks only cost tokens.
     """
     if not isinstance(sql_result, dict):
         sql_result = {"rows": [], "error": "Invalid SQL result format"}
@@ -938,10 +1199,16 @@ def _prepare_answer_context(query: str, sql_result: Dict[str, Any], sql: str, fl
     analysis_request = _get_analysis_request(sql_result)
     if analysis_request:
         context["analysis_request"] = analysis_request
+    reminder = ANSWER_CONTEXT_REMINDER
     if "error" in sql_result:
-        context["error"] = sql_result["error"]
+        error = sql_result["error"]
+        if isinstance(error, str) and len(error) > ANSWER_CONTEXT_MAX_ERROR_CHARS:
+            error = error[:ANSWER_CONTEXT_MAX_ERROR_CHARS] + f"... <{len(error)} chars>"
+        context["error"] = error
+        if not rows:
+            reminder = ANSWER_ERROR_CONTEXT_REMINDER
     if rows:
-        context["rows"] = rows[:10]
+        context["rows"] = _sample_rows_for_context(rows)
     elif "download_url" in sql_result:
         context["download_url"] = sql_result["download_url"]
     if "field_error" in sql_result:
@@ -951,34 +1218,24 @@ def _prepare_answer_context(query: str, sql_result: Dict[str, Any], sql: str, fl
     if "suggested_fields" in sql_result:
         context["suggested_fields"] = sql_result["suggested_fields"]
     context_str = _safe_context_serialize(context, query, sql, row_count, is_fallback)
-    glossary_str = glossary_to_string(DOMAIN_GLOSSARY)
-    business_rules_str = "\n".join(BUSINESS_RULES['rules'])
     user_question_block = f"User question: {query}\n"
     field_info_blocks = _add_field_info_blocks(sql_result)
-    hallucination_reminder = (
-        "\n\nWhen explaining results or errors, use the Domain Glossary to clarify terms, and refer to the Business Rules to guide your suggestions."
-        "\n\n[Reminder to LLM: Always mention the fleet_id (and fleet name if available) in your answer, so the user knows which fleet the data refers to. "
-        "Only use columns and tables defined in the schema. If the SQL result is empty or contains errors, analyze the reason and provide a helpful explanation to the user. "
-        "Suggest how they might rephrase their question to get the information they need.]"
-        "\n\nGiven the above context, analyze the SQL and its result. If there is an error, explain the likely cause in plain language, referencing the Domain Glossary and Business Rules as needed. Suggest how the user could rephrase or clarify their question to get a better answer."
-    )
     return (
         user_question_block +
         field_info_blocks +
-        f"\nDomain Glossary:\n{glossary_str}\n" +
-        f"\nBusiness Rules:\n{business_rules_str}\n" +
-        f"\nContext:\n{context_str}" +
-        hallucination_reminder
+        ANSWER_CONTEXT_JSON_MARKER + context_str +
+        reminder
     )
 
 async def _handle_column_error(error_message: str) -> str:
     """Handle column-related errors."""
-    column_match = re.search(r'column ([\w.]+) does not exist', error_message, re.IGNORECASE)
+    column_match = MISSING_COLUMN_RE.search(error_message)
     if not column_match:
         return f"I encountered an error: {error_message}. Please try again with a different question."
         
     bad_column = column_match.group(1)
-    if "energy" in bad_column.lower() and "trips" in bad_column.lower():
+    lowered = bad_column.lower()
+    if "energy" in lowered and "trips" in lowered:
         return f"I encountered an error with the column '{bad_column}'. In our database, the trips table has 'energy_kwh' instead of just 'energy'."
     
     return f"I encountered an error with the column '{bad_column}' which doesn't exist in our database."
@@ -998,6 +1255,107 @@ def get_llm_provider() -> str:
         return "deepseek"
     raise RuntimeError("No LLM provider configured and no API key found.")
 
+def _provider_order() -> List[str]:
+    """
+    List the providers to ask for SQL or an answer, the configured provider first.
+
+    An explicit LLM_PROVIDER pins requests to that provider; otherwise every
+    provider with an API key takes part.
+    """
+    primary = get_llm_provider()
+    if os.getenv("LLM_PROVIDER"):
+        return [primary]
+    return [primary] + [name for name in get_available_llm_providers() if name != primary]
+
+def _hedge_delay(kind: str, provider: str) -> float:
+    """How long the primary provider runs alone: its recent p95 latency for this kind of request."""
+    samples = _provider_latencies.get((kind, provider))
+    if not samples or len(samples) < HEDGE_LATENCY_MIN_SAMPLES:
+        return HEDGE_DELAY
+    ordered = sorted(samples)
+    return ordered[int(0.95 * (len(ordered) - 1))]
+
+def _record_provider_latency(kind: str, provider: str, seconds: float) -> None:
+    """Remember how long a provider took to answer a kind of request."""
+    samples = _provider_latencies.get((kind, provider))
+    if samples is None:
+        samples = _provider_latencies[(kind, provider)] = collections.deque(maxlen=HEDGE_LATENCY_WINDOW)
+    samples.append(seconds)
+
+async def _hedged_request(kind: str, provider_names: List[str], request: Callable[[str], Awaitable[Any]]) -> Any:
+    """
+    Send a request to LLM providers as a hedged request and return the first truthy result.
+
+    The first provider is asked alone. If it has not answered within its recent p95
+    latency, or fails, the remaining providers are asked as well, and whichever
+    answers first wins; the other requests are cancelled. A slow provider therefore
+    costs at most one p95 of extra latency, while the common case makes one call.
+
+    Args:
+        kind: Request kind ("sql" or "answer"); latencies are tracked per kind
+        provider_names: Providers to ask, primary first
+        request: Sends the request to the named provider
+
+    Raises:
+        The last provider error if no provider produced a result
+    """
+    tasks: Dict[asyncio.Task, Tuple[str, float]] = {}
+
+    def ask(name: str) -> "asyncio.Task":
+        task = asyncio.create_task(request(name))
+        tasks[task] = (name, time.monotonic())
+        return task
+
+    primary, backups = provider_names[0], list(provider_names[1:])
+    pending = {ask(primary)}
+    last_error: Optional[Exception] = None
+    try:
+        while pending:
+            timeout = _hedge_delay(kind, primary) if backups else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name, started = tasks[task]
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    logger.warning("Error with %s: %s", name, last_error)
+                    continue
+                result = task.result()
+                if result:
+                    _record_provider_latency(kind, name, time.monotonic() - started)
+                    return result
+            if backups and (not done or not pending):
+                # The primary is slow or failed: hedge with the other providers
+                logger.debug("Hedging %s request to %s", kind, ", ".join(backups))
+                pending |= {ask(name) for name in backups}
+                backups = []
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    raise last_error or ValueError(f"All LLM providers returned empty {kind} results")
+
+async def _first_successful_answer(context_str: str, provider_names: List[str]) -> str:
+    """
+    Ask providers for an answer with a hedged request (see _hedged_request).
+
+    Answers are cached on the full context (query, SQL, fleet and result rows), so
+    an identical request is served without any LLM call.
+    """
+    cache_key = hash_key(context_str)
+    cached = answer_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Built once and shared by every provider asked
+    messages = build_answer_messages(context_str)
+    answer = await _hedged_request(
+        "answer", provider_names,
+        lambda name: llm_answer_format(context_str, name, messages=messages)
+    )
+    answer_cache.set(cache_key, answer)
+    return answer
+
 def glossary_to_string(glossary: dict, include_why_it_matters: bool = True) -> str:
     """
     Format the glossary as a readable string for LLM context.
@@ -1014,36 +1372,89 @@ def glossary_to_string(glossary: dict, include_why_it_matters: bool = True) -> s
             lines.append(f"  Why it matters: {info['why_it_matters']}")
     return "\n".join(lines)
 
+# The glossary is static, so render it once instead of on every prompt build
+DOMAIN_GLOSSARY_STR = glossary_to_string(DOMAIN_GLOSSARY, include_why_it_matters=True)
+
+# Answers are asked to stay under 100 words (~130 tokens); the cap leaves a little headroom
+ANSWER_MAX_TOKENS = 200
+
+# Static answer instructions, glossary and business rules. Kept byte-identical across
+# requests and sent ahead of the per-query context so providers can reuse the cached
+# prompt prefix instead of re-processing it on every call.
+ANSWER_SYSTEM_PROMPT = f"""You are a fleet analytics assistant.
+Given SQL query results, provide a concise, human-readable answer to the original question.
+Respond in plain text only. Do not use Markdown, code blocks, or formatting tags. Use natural line breaks for clarity.
+Be direct and informative. Include key numbers and insights. Keep your answer under 100 words.
+
+Use the specialized terms from the domain glossary below appropriately in your response to sound more domain-aware.
+When metrics like SOH (State of Health), SOC (State of Charge), or other domain-specific terms are involved, use the correct terminology and explain the results in fleet management context.
+
+Domain Glossary:
+{DOMAIN_GLOSSARY_STR}
+
+Business Rules:
+{BUSINESS_RULES_STR}"""
+
+def _coerce_fleet_id(fleet_id: Any) -> int:
+    """Validate that fleet_id is an integer before it reaches the database."""
+    try:
+        return int(fleet_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid fleet_id: {fleet_id!r}")
+
 async def setup_database_session(conn, fleet_id: int) -> None:
     """
-    Set up database session with timeouts and fleet ID.
+    Set up database session with the fleet ID.
+
+    The statement timeout is already set on every pooled connection, so this is a
+    single set_config() statement. The fleet ID is bound as a parameter rather than
+    interpolated, so the statement text is identical for every fleet and its plan
+    can be reused. The setting is transaction-local, so it never leaks to the
+    next pool checkout.
+    """
+    await conn.execute(SESSION_SETUP_SQL, {"fleet_id": str(int(fleet_id))})
+
+async def _llm_nl_to_sql(provider: str, query: str, model: Optional[str] = None) -> Dict[str, str]:
     """
-    await conn.execute(sa.text("SET statement_timeout = 20000"))
-    fleet_id_sql = f"SET app.fleet_id = {fleet_id}"
-    await conn.execute(sa.text(fleet_id_sql))
+    Unified function to convert natural language to SQL using the specified LLM provider.
 
-async def _llm_nl_to_sql(provider: str, query: str) -> Dict[str, str]:
-    """Unified function to convert natural language to SQL using the specified LLM provider."""
+    SQL is generated at a fixed low temperature from a prompt that only varies with
+    the query, so results are cached per provider, model and normalized query.
+    SQL that references columns missing from the schema is rejected before it is
+    cached, so the provider is asked again next time.
+
+    Raises:
+        InvalidColumnError: If the generated SQL references unknown columns
+    """
+    if model is None and provider in SQL_GENERATION_MODELS:
+        model = _pick_sql_model(provider, query)
+    cache_key = hash_key(provider, model or "", normalize_query(query))
+    cached = sql_cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+    result = await _request_sql(provider, query, model)
+    if result.get("sql"):
+        unknown_columns = find_unknown_columns(result["sql"])
+        if unknown_columns:
+            logger.warning("%s generated SQL with unknown columns: %s", provider, unknown_columns)
+            raise InvalidColumnError(unknown_columns)
+        sql_cache.set(cache_key, dict(result))
+    return result
+
+async def _request_sql(provider: str, query: str, model: Optional[str]) -> Dict[str, str]:
+    """Ask one LLM provider for the SQL for a query."""
     try:
         if provider == "openai":
-            client = AsyncOpenAI(
-                api_key=os.getenv("OPENAI_API_KEY"),
-                http_client=httpx.AsyncClient(timeout=60.0)
-            )
-            system_prompt = _create_sql_generation_prompt()
-            response = await client.chat.completions.create(
-                model="gpt-4o",
+            client = get_openai_client()
+            system_prompt = SQL_GENERATION_SYSTEM_PROMPT
+            response = await call_provider(
+                provider, client.chat.completions.create,
+                model=model,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": prepare_sql_generation_context(query)}
                 ],
-                functions=[
-                    {
-                        "name": "generate_sql",
-                        "description": "Generate a SQL query from natural language",
-                        "parameters": GenerateSQLParameters.model_json_schema()
-                    }
-                ],
+                functions=SQL_GENERATION_FUNCTIONS,
                 function_call={"name": "generate_sql"},
                 temperature=0.2
             )
@@ -1052,35 +1463,31 @@ async def _llm_nl_to_sql(provider: str, query: str) -> Dict[str, str]:
             return {"sql": sql, "prompt": system_prompt}
             
         elif provider == "anthropic":
-            anthropic_client = anthropic.Anthropic(
-                api_key=os.getenv("ANTHROPIC_API_KEY"),
-                timeout=60.0
-            )
-            prompt = f"""{_create_sql_generation_prompt()}
-
-{prepare_sql_generation_context(query)}
-
-SQL query:"""
+            anthropic_client = get_anthropic_client()
+            question = SQL_QUESTION_TEMPLATE.format(query=query)
     
-            response = anthropic_client.messages.create(
-                model="claude-3-opus-20240229",
+            response = await call_provider(
+                provider, anthropic_client.messages.create,
+                model=model,
                 max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}],
+                system=[{
+                    "type": "text",
+                    "text": SQL_GENERATION_PROMPT_PREFIX,
+                    "cache_control": {"type": "ephemeral"}
+                }],
+                messages=[{"role": "user", "content": question}],
                 temperature=0.2
             )
             sql = response.content[0].text.strip()
-            return {"sql": sql, "prompt": prompt}
+            return {"sql": sql, "prompt": f"{SQL_GENERATION_PROMPT_PREFIX}\n\n{question}"}
             
         elif provider == "mistral":
-            mistral_client = MistralClient(api_key=os.getenv("MISTRAL_API_KEY"))
-            prompt = f"""{_create_sql_generation_prompt()}
-
-{prepare_sql_generation_context(query)}
-
-SQL query:"""
+            mistral_client = get_mistral_client()
+            prompt = f"{SQL_GENERATION_PROMPT_PREFIX}\n\n{SQL_QUESTION_TEMPLATE.format(query=query)}"
     
-            response = mistral_client.chat(
-                model="mistral-large-latest",
+            response = await call_provider(
+                provider, mistral_client.chat.complete_async,
+                model=model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.2
             )
@@ -1088,19 +1495,12 @@ SQL query:"""
             return {"sql": sql, "prompt": prompt}
             
         elif provider == "deepseek":
-            client = AsyncOpenAI(
-                api_key=os.getenv("DEEPSEEK_API_KEY"),
-                base_url="https://api.deepseek.com/v1",
-                http_client=httpx.AsyncClient(timeout=60.0)
-            )
-            prompt = f"""{_create_sql_generation_prompt()}
-
-{prepare_sql_generation_context(query)}
-
-SQL query:"""
+            client = get_deepseek_client()
+            prompt = f"{SQL_GENERATION_PROMPT_PREFIX}\n\n{SQL_QUESTION_TEMPLATE.format(query=query)}"
             
-            response = await client.chat.completions.create(
-                model="deepseek-chat",
+            response = await call_provider(
+                provider, client.chat.completions.create,
+                model=model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.2
             )
@@ -1111,38 +1511,67 @@ SQL query:"""
             raise ValueError(f"Unknown provider: {provider}")
             
     except Exception as e:
-        print(f"Error in _llm_nl_to_sql with provider {provider}: {str(e)}")
+        logger.error("Error in _request_sql with provider %s: %s", provider, e)
         raise
 
 async def llm_nl_to_sql(query: str) -> Dict[str, str]:
-    """Convert natural language to SQL using the configured LLM provider."""
-    provider = get_llm_provider()
-    return await _llm_nl_to_sql(provider, query)
-
-async def answer_format(query: str, sql_result: Dict[str, Any], sql: str, fleet_id: Optional[int] = None) -> str:
-    """Format results into a human-readable answer using the configured LLM provider."""
-    context = _prepare_answer_context(query, sql_result, sql, fleet_id=fleet_id)
-    provider = get_llm_provider()
-    answer = await llm_answer_format(context, provider)
+    """
+    Convert natural language to SQL using the configured LLM provider.
+
+    Recurring questions with canned SQL (see canned_sql) skip the LLM entirely.
+    Otherwise the other providers with API keys are asked as well if it fails,
+    returns no SQL or is slow (see _hedged_request), unless LLM_PROVIDER pins a
+    single provider. SQL that references columns missing from the schema counts
+    as a failure, so it never reaches the database.
+    """
+    canned_sql = match_canned_sql(query)
+    if canned_sql is not None:
+        logger.debug("Using canned SQL for: '%s'", query)
+        return {"sql": canned_sql, "prompt": ""}
+
+    async def request(provider: str) -> Optional[Dict[str, str]]:
+        result = await _llm_nl_to_sql(provider, query)
+        return result if result.get("sql") else None
+
+    return await _hedged_request("sql", _provider_order(), request)
+
+async def answer_format(query: str, sql_result: Dict[str, Any], sql: str, fleet_id: Optional[int] = None, context: Optional[str] = None) -> str:
+    """
+    Format results into a human-readable answer using the configured LLM provider.
+
+    Callers that also need the answer context can build it once and pass it as context.
+    """
+    if context is None:
+        context = _prepare_answer_context(query, sql_result, sql, fleet_id=fleet_id)
+    answer = await _first_successful_answer(context, _provider_order())
+    return postprocess_answer(answer, fleet_id)
+
+# Anything postprocess_answer filters out: SQL code blocks and suggestion lines
+ANSWER_CLEANUP_TRIGGER_RE = re.compile(r"```sql|Suggested refinement|Example:|query the")
+
+def postprocess_answer(answer: str, fleet_id: Optional[int] = None) -> str:
+    """Clean up a raw LLM answer for display to the user."""
     # Post-process: replace ':fleet_id' with the actual value if available
     if fleet_id is not None:
         answer = answer.replace(FLEET_ID_PLACEHOLDER, str(fleet_id))
-    # Remove technical suggestions and SQL code blocks
     lines = answer.splitlines()
-    filtered_lines = []
-    in_code_block = False
-    for line in lines:
-        # Remove code blocks and lines with 'Suggested refinement' or 'Example:'
-        if line.strip().startswith('```sql'):
-            in_code_block = True
-            continue
-        if in_code_block:
-            if line.strip().startswith('```'):
-                in_code_block = False
-            continue
-        if 'Suggested refinement' in line or 'Example:' in line or 'query the' in line:
-            continue
-        filtered_lines.append(line)
+    # Remove technical suggestions and SQL code blocks; most answers have none
+    filtered_lines = lines
+    if ANSWER_CLEANUP_TRIGGER_RE.search(answer):
+        filtered_lines = []
+        in_code_block = False
+        for line in lines:
+            # Remove code blocks and lines with 'Suggested refinement' or 'Example:'
+            if line.strip().startswith('```sql'):
+                in_code_block = True
+                continue
+            if in_code_block:
+                if line.strip().startswith('```'):
+                    in_code_block = False
+                continue
+            if 'Suggested refinement' in line or 'Example:' in line or 'query the' in line:
+                continue
+            filtered_lines.append(line)
     # Remove extra blank lines
     filtered_answer = '\n'.join([line for line in filtered_lines if line.strip()])
     # Append fleet_id at the bottom only if not already present
@@ -1155,89 +1584,193 @@ async def _safe_context_preparation(query: str, context: Dict[str, Any], sql: st
     try:
         return _prepare_answer_context(query, context, sql)
     except Exception as e:
-        print(f"Error in _safe_context_preparation: {str(e)}")
+        logger.error("Error in _safe_context_preparation: %s", e)
         return f"User question: {query}\nSQL: {sql}\nError: {str(e)}"
 
-async def llm_answer_format(context_str: str, provider: str) -> str:
-    """Format results into a human-readable answer using the specified LLM provider."""
-    prompt = f"""You are a fleet analytics assistant.
-Given SQL query results, provide a concise, human-readable answer to the original question.
-Respond in plain text only. Do not use Markdown, code blocks, or formatting tags. Use natural line breaks for clarity.
-Be direct and informative. Include key numbers and insights. Keep your answer under 100 words.
-
-The context contains a domain glossary with fleet management terms. Use these specialized terms appropriately in your response to sound more domain-aware.
-When metrics like SOH (State of Health), SOC (State of Charge), or other domain-specific terms are involved, use the correct terminology and explain the results in fleet management context.
-
-Here is the context including the domain glossary, query, SQL, and results:
+def build_answer_messages(context_str: str) -> List[Dict[str, str]]:
+    """Build the chat messages that ask an LLM to answer from the given context."""
+    prompt = f"""Here is the context including the query, SQL, and results:
 {context_str}
 
 Provide a concise answer to the original query based on these results:"""
+    return [
+        {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+async def llm_answer_format(context_str: str, provider: str, messages: Optional[List[Dict[str, str]]] = None) -> str:
+    """
+    Format results into a human-readable answer using the specified LLM provider.
+
+    The static ANSWER_SYSTEM_PROMPT goes first as the system prompt and only the
+    per-query context is sent as the user message, so the shared prefix is served
+    from the provider's prompt cache.
+
+    Args:
+        context_str: Answer context from _prepare_answer_context
+        provider: LLM provider name
+        messages: Messages already built from context_str by build_answer_messages,
+            so callers trying several providers only build them once
+    """
+    if messages is None:
+        messages = build_answer_messages(context_str)
+    prompt = messages[-1]["content"]
 
     if provider == "openai":
-        client = AsyncOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            http_client=httpx.AsyncClient(timeout=60.0)
-        )
-        response = await client.chat.completions.create(
+        client = get_openai_client()
+        response = await call_provider(
+            provider, client.chat.completions.create,
             model="gpt-4",
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": prompt}
-            ]
+            messages=messages,
+            max_tokens=ANSWER_MAX_TOKENS
         )
         return response.choices[0].message.content.strip()
     elif provider == "anthropic":
-        anthropic_client = anthropic.Anthropic(
-            api_key=os.getenv("ANTHROPIC_API_KEY"),
-            timeout=60.0
-        )
-        response = anthropic_client.messages.create(
+        anthropic_client = get_anthropic_client()
+        response = await call_provider(
+            provider, anthropic_client.messages.create,
             model="claude-3-haiku-20240307",
-            max_tokens=300,
+            max_tokens=ANSWER_MAX_TOKENS,
+            system=[{
+                "type": "text",
+                "text": ANSWER_SYSTEM_PROMPT,
+                "cache_control": {"type": "ephemeral"}
+            }],
             messages=[{"role": "user", "content": prompt}]
         )
         return response.content[0].text.strip()
     elif provider == "mistral":
-        mistral_client = MistralClient(
-            api_key=os.getenv("MISTRAL_API_KEY")
-        )
-        response = mistral_client.chat(
+        mistral_client = get_mistral_client()
+        response = await call_provider(
+            provider, mistral_client.chat.complete_async,
             model="mistral-small-latest",
-            messages=[{"role": "user", "content": prompt}]
+            messages=messages,
+            max_tokens=ANSWER_MAX_TOKENS
         )
         return response.choices[0].message.content.strip()
     elif provider == "deepseek":
-        client = AsyncOpenAI(
-            api_key=os.getenv("DEEPSEEK_API_KEY"),
-            base_url="https://api.deepseek.com/v1",
-            http_client=httpx.AsyncClient(timeout=60.0)
-        )
-        response = await client.chat.completions.create(
+        client = get_deepseek_client()
+        response = await call_provider(
+            provider, client.chat.completions.create,
             model="deepseek-chat",
-            messages=[{"role": "user", "content": prompt}],
+            messages=messages,
+            max_tokens=ANSWER_MAX_TOKENS,
             temperature=0.2
         )
         return response.choices[0].message.content.strip()
     else:
         raise ValueError(f"Unknown provider: {provider}")
 
-def prepare_sql_generation_context(query: str) -> str:
-    """Prepare context for SQL generation including domain glossary and schema."""
-    mapping_table, _ = get_semantic_mapping_prompt()
-    glossary_str = glossary_to_string(DOMAIN_GLOSSARY, include_why_it_matters=True)
-    return f"""User question: {query}
+async def llm_answer_format_stream(context_str: str, provider: str, messages: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+    """
+    Stream an answer from the specified LLM provider, yielding text as it arrives.
+
+    Uses the same models and prompts as llm_answer_format. The provider slot is
+    held until the stream ends; only opening the stream is retried.
+    """
+    if messages is None:
+        messages = build_answer_messages(context_str)
+
+    async with llm_slot(provider):
+        if provider in ("openai", "deepseek"):
+            if provider == "openai":
+                client = get_openai_client()
+                options = {"model": "gpt-4"}
+            else:
+                client = get_deepseek_client()
+                options = {"model": "deepseek-chat", "temperature": 0.2}
+            stream = await call_with_retries(
+                client.chat.completions.create,
+                messages=messages,
+                max_tokens=ANSWER_MAX_TOKENS,
+                stream=True,
+                **options
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        elif provider == "anthropic":
+            anthropic_client = get_anthropic_client()
+            async with anthropic_client.messages.stream(
+                model="claude-3-haiku-20240307",
+                max_tokens=ANSWER_MAX_TOKENS,
+                system=[{
+                    "type": "text",
+                    "text": ANSWER_SYSTEM_PROMPT,
+                    "cache_control": {"type": "ephemeral"}
+                }],
+                messages=[{"role": "user", "content": messages[-1]["content"]}]
+            ) as stream:
+                async for text in stream.text_stream:
+                    yield text
+        elif provider == "mistral":
+            mistral_client = get_mistral_client()
+            stream = await call_with_retries(
+                mistral_client.chat.stream_async,
+                model="mistral-small-latest",
+                messages=messages,
+                max_tokens=ANSWER_MAX_TOKENS
+            )
+            async for event in stream:
+                content = event.data.choices[0].delta.content
+                if content:
+                    yield content
+        else:
+            raise ValueError(f"Unknown provider: {provider}")
 
-[Semantic Mapping]
-{mapping_table}
+async def stream_answer(context_str: str) -> AsyncIterator[str]:
+    """
+    Stream an answer for a prepared context, trying providers in answer order.
+
+    A provider that fails before producing any text is skipped in favour of the
+    next one; a failure mid-answer is raised. Complete answers go into the answer
+    cache, and a cached answer is yielded in one piece.
+    """
+    cache_key = hash_key(context_str)
+    cached = answer_cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    messages = build_answer_messages(context_str)
+    last_error: Optional[Exception] = None
+    for name in _provider_order():
+        chunks: List[str] = []
+        try:
+            async for text in llm_answer_format_stream(context_str, name, messages=messages):
+                chunks.append(text)
+                yield text
+        except Exception as e:
+            if chunks:
+                raise
+            last_error = e
+            logger.warning("Error with %s: %s", name, e)
+            continue
+        answer = "".join(chunks).strip()
+        if answer:
+            answer_cache.set(cache_key, answer)
+            return
+    raise last_error or ValueError("All LLM providers returned empty answers")
+
+# Everything in the SQL prompts after the user question is static, so it is
+# assembled once here and each request only prepends the question
+SQL_PROMPT_BODY = f"""
+
+[Semantic Mapping]\n{SEMANTIC_MAPPING_TABLE}\n\n[Domain Glossary]\n{DOMAIN_GLOSSARY_STR}\n\n[Critical Info]\n{CRITICAL_INFO_PROMPT}\n\n[Schema]\n{SCHEMA_PROMPT}\n\n{SQL_PROMPT_ANTI_PATTERNS}\n\n{SQL_PROMPT_EXAMPLES}\n\n{SQL_PROMPT_REQUIREMENTS}\n"""
+# Static SQL generation context. It goes ahead of the user question so that, after
+# the system prompt, every request shares the same prefix and providers can serve
+# it from their prompt caches.
+SQL_GENERATION_CONTEXT = f"""[Semantic Mapping]
+{SEMANTIC_MAPPING_TABLE}
 
 [Domain Glossary]
-{glossary_str}
+{DOMAIN_GLOSSARY_STR}
 
 [Critical Info]
-{_format_critical_info_for_prompt()}
+{CRITICAL_INFO_PROMPT}
 
 [Schema]
-{_format_schema_for_prompt()}
+{SCHEMA_PROMPT}
 
 Requirements:
 1. Always include 'WHERE fleet_id = :fleet_id' in your query for security
@@ -1248,19 +1781,43 @@ Requirements:
 6. YOU MUST GENERATE A VALID PostgreSQL QUERY that starts with SELECT 
 7. DO NOT return an empty response
 8. Use the domain glossary provided above to understand fleet-specific terminology and tables"""
+# Single-message SQL prompts (Anthropic, Mistral, DeepSeek) are the prefix followed by the question
+SQL_GENERATION_PROMPT_PREFIX = f"{SQL_GENERATION_SYSTEM_PROMPT}\n\n{SQL_GENERATION_CONTEXT}"
+SQL_QUESTION_TEMPLATE = "User question: {query}\n\nSQL query:"
+# OpenAI function definition for SQL generation, built once from the pydantic model
+SQL_GENERATION_FUNCTIONS = [
+    {
+        "name": "generate_sql",
+        "description": "Generate a SQL query from natural language",
+        "parameters": GenerateSQLParameters.model_json_schema()
+    }
+]
+
+def prepare_sql_generation_context(query: str) -> str:
+    """Prepare context for SQL generation including domain glossary and schema."""
+    return f"{SQL_GENERATION_CONTEXT}\n\nUser question: {query}"
 
 async def sql_exec(sql: str, fleet_id: int) -> Dict[str, Any]:
-    """Execute SQL query with proper error handling and result formatting."""
+    """
+    Execute SQL query with proper error handling and result formatting.
+
+    Results larger than LARGE_RESULT_THRESHOLD rows are streamed to a CSV file and
+    returned as a download_url with no inline rows.
+    """
+    fleet_id = _coerce_fleet_id(fleet_id)
     try:
         async with engine.connect() as conn:
             await setup_database_session(conn, fleet_id)
-            rows, error = await execute_sql_query(conn, sql, {"fleet_id": fleet_id})
-            
-            if error:
+            result = await stream_sql_query(conn, sql, {"fleet_id": fleet_id})
+            rows = result["rows"]
+
+            if "download_url" in result:
+                # Too large to return inline; exported to CSV
                 return {
                     "rows": [],
-                    "error": error,
-                    "is_empty_result": True
+                    "row_count": result["row_count"],
+                    "download_url": result["download_url"],
+                    "is_empty_result": False
                 }
                 
             if not rows:
@@ -1277,16 +1834,41 @@ async def sql_exec(sql: str, fleet_id: int) -> Dict[str, Any]:
             }
             
     except Exception as e:
-        print(f"Error executing SQL: {str(e)}")
+        logger.error("Error executing SQL: %s", e)
         return {
             "rows": [],
             "error": str(e),
             "is_empty_result": True
         }
 
+async def _sql_exec_with_fallback(query: str, sql: str, fleet_id: int, strategy: str) -> Dict[str, Any]:
+    """
+    Execute SQL, running the generic fallback query concurrently when the strategy can use it.
+
+    The strict and cite strategies answer empty results from a generic query over the
+    same table. Starting it together with the primary query saves a sequential round
+    trip; it is cancelled as soon as the primary query returns rows or fails.
+    """
+    if strategy not in FALLBACK_QUERY_STRATEGIES:
+        return await sql_exec(sql, fleet_id)
+    fallback_task = asyncio.ensure_future(_try_fallback_query(query, sql, fleet_id))
+    try:
+        exec_result = await sql_exec(sql, fleet_id)
+    except BaseException:
+        fallback_task.cancel()
+        raise
+    if exec_result.get("query_context"):
+        exec_result["fallback_result"] = await fallback_task
+    else:
+        fallback_task.cancel()
+    return exec_result
+
 async def process_query(query: str, fleet_id: int, strategy: str = "base") -> Dict[str, Any]:
     """
     Process a natural language query end-to-end with specified strategy.
+
+    Identical requests (same query, fleet and strategy) that arrive while one is
+    already running share its result instead of repeating the LLM and database work.
     
     Args:
         query: Natural language query
@@ -1296,14 +1878,36 @@ async def process_query(query: str, fleet_id: int, strategy: str = "base") -> Di
     Returns:
         dict with keys: answer, sql, rows, download_url, is_fallback, prompt_sql, prompt_answer
     """
-    print(f"[process_query] Processing query: '{query}' with strategy: '{strategy}'")
+    fleet_id = _coerce_fleet_id(fleet_id)
+    key = (query.strip(), fleet_id, strategy)
+    task = _inflight_queries.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_process_query(query, fleet_id, strategy))
+        _inflight_queries[key] = task
+        task.add_done_callback(lambda done: _release_inflight_query(key, done))
+    else:
+        logger.debug("Joining in-flight request for: '%s'", query)
+    result = await asyncio.shield(task)
+    return dict(result)
+
+def _release_inflight_query(key: Tuple[str, int, str], task: "asyncio.Future") -> None:
+    """Forget a finished in-flight request so later calls run afresh."""
+    if _inflight_queries.get(key) is task:
+        del _inflight_queries[key]
+
+async def _process_query(query: str, fleet_id: int, strategy: str) -> Dict[str, Any]:
+    """Run the NL-to-SQL, execution and answer steps for one query."""
+    logger.info("Processing query: '%s' with strategy: '%s'", query, strategy)
     try:
         sql_result = await llm_nl_to_sql(query)
         if not sql_result or "sql" not in sql_result:
             raise ValueError("Failed to generate SQL from query")
         sql = sql_result["sql"]
-        exec_result = await sql_exec(sql, fleet_id)
-        answer = await generate_with_constraints(query, exec_result, sql, strategy, fleet_id=fleet_id)
+        exec_result = await _sql_exec_with_fallback(query, sql, fleet_id, strategy)
+        prompt_answer = _prepare_answer_context(query, exec_result, sql, fleet_id=fleet_id)
+        answer = await generate_with_constraints(
+            query, exec_result, sql, strategy, fleet_id=fleet_id, prepared_context=prompt_answer
+        )
         return {
             "answer": answer,
             "sql": sql,
@@ -1311,28 +1915,91 @@ async def process_query(query: str, fleet_id: int, strategy: str = "base") -> Di
             "download_url": exec_result.get("download_url", None),
             "is_fallback": False,
             "prompt_sql": sql_result.get("prompt", ""),
-            "prompt_answer": _prepare_answer_context(query, exec_result, sql, fleet_id=fleet_id)
+            "prompt_answer": prompt_answer
         }
     except Exception as e:
-        import traceback
         error_msg = f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
-        print(f"[process_query] Error: {error_msg}")
-        sql = sql if 'sql' in locals() else ""
-        exec_result = exec_result if 'exec_result' in locals() else {"rows": [], "error": error_msg}
-        try:
-            answer = await answer_format(query, exec_result, sql, fleet_id=fleet_id)
-        except Exception as e2:
-            print(f"[process_query] LLM 2nd prompt also failed: {str(e2)}")
-            answer = TROUBLE_MSG
-        resp = {
-            "answer": answer,
+        logger.error("process_query failed: %s", error_msg)
+        return await _query_error_result(
+            query, fleet_id, error_msg,
+            sql=sql if 'sql' in locals() else "",
+            exec_result=exec_result if 'exec_result' in locals() else None,
+            prompt_sql=sql_result.get("prompt", "") if 'sql_result' in locals() else ""
+        )
+
+async def _query_error_result(query: str, fleet_id: int, error_msg: str, sql: str = "", exec_result: Optional[Dict[str, Any]] = None, prompt_sql: str = "") -> Dict[str, Any]:
+    """Build the process_query result for a failed query, asking the LLM to explain the error."""
+    if exec_result is None:
+        exec_result = {"rows": [], "error": error_msg}
+    prompt_answer = _prepare_answer_context(query, exec_result, sql, fleet_id=fleet_id)
+    try:
+        answer = await answer_format(query, exec_result, sql, fleet_id=fleet_id, context=prompt_answer)
+    except Exception as e2:
+        logger.error("LLM 2nd prompt also failed: %s", e2)
+        answer = TROUBLE_MSG
+    resp = {
+        "answer": answer,
+        "sql": sql,
+        "rows": exec_result.get("rows", []),
+        "download_url": exec_result.get("download_url", None),
+        "is_fallback": True,
+        "error": True,
+        "error_details": error_msg,
+        "prompt_sql": prompt_sql,
+        "prompt_answer": prompt_answer
+    }
+    return resp
+
+async def process_query_stream(query: str, fleet_id: int, strategy: str = "base") -> AsyncIterator[Dict[str, Any]]:
+    """
+    Process a query like process_query, streaming the answer while it is generated.
+
+    Yields {"type": "delta", "text": ...} events as answer text arrives, then one
+    {"type": "result", ...} event carrying the same fields as process_query. The
+    result answer is post-processed, so clients should show it in place of the
+    streamed text. The strict and cite strategies, and failed queries, deliver the
+    answer in a single delta.
+    """
+    fleet_id = _coerce_fleet_id(fleet_id)
+    if strategy in FALLBACK_QUERY_STRATEGIES:
+        result = await process_query(query, fleet_id, strategy)
+        yield {"type": "delta", "text": result["answer"]}
+        yield {"type": "result", **result}
+        return
+
+    logger.info("Streaming query: '%s' with strategy: '%s'", query, strategy)
+    sql = ""
+    sql_result: Dict[str, str] = {}
+    exec_result: Optional[Dict[str, Any]] = None
+    streamed = False
+    try:
+        sql_result = await llm_nl_to_sql(query)
+        if not sql_result or "sql" not in sql_result:
+            raise ValueError("Failed to generate SQL from query")
+        sql = sql_result["sql"]
+        exec_result = await _sql_exec_with_fallback(query, sql, fleet_id, strategy)
+        prompt_answer = _prepare_answer_context(query, exec_result, sql, fleet_id=fleet_id)
+        chunks: List[str] = []
+        async for text in stream_answer(prompt_answer):
+            chunks.append(text)
+            streamed = True
+            yield {"type": "delta", "text": text}
+        result = {
+            "answer": postprocess_answer("".join(chunks).strip(), fleet_id),
             "sql": sql,
             "rows": exec_result.get("rows", []),
             "download_url": exec_result.get("download_url", None),
-            "is_fallback": True,
-            "error": True,
-            "error_details": error_msg,
-            "prompt_sql": sql_result.get("prompt", "") if 'sql_result' in locals() else "",
-            "prompt_answer": _prepare_answer_context(query, exec_result, sql, fleet_id=fleet_id) if 'exec_result' in locals() and 'sql' in locals() else ""
+            "is_fallback": False,
+            "prompt_sql": sql_result.get("prompt", ""),
+            "prompt_answer": prompt_answer
         }
-        return resp
\ No newline at end of file
+    except Exception as e:
+        error_msg = f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
+        logger.error("process_query_stream failed: %s", error_msg)
+        result = await _query_error_result(
+            query, fleet_id, error_msg, sql=sql, exec_result=exec_result,
+            prompt_sql=sql_result.get("prompt", "") if sql_result else ""
+        )
+        if not streamed:
+            yield {"type": "delta", "text": result["answer"]}
+    yield {"type": "result", **result}
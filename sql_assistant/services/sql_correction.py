@@ -3,10 +3,14 @@ SQL correction utilities for VerseMind SQL Assistant.
 
 This module handles SQL validation and correction.
 """
+import logging
 import re
 from typing import Tuple
 
 from sql_assistant.guardrails import validate_sql
+from sql_assistant.services.active_conditions import process_active_conditions
+
+logger = logging.getLogger(__name__)
 
 # SQL pattern constants to avoid duplication
 ACTIVE_VEHICLES_SQL_PATTERN = (
@@ -15,15 +19,29 @@ ACTIVE_VEHICLES_SQL_PATTERN = (
     "AND EXTRACT(YEAR FROM trips.start_ts) = EXTRACT(YEAR FROM CURRENT_DATE))"
 )
 
+# The SELECT keyword anywhere in the text, in any case
+SELECT_RE = re.compile(r'\bSELECT\b', re.IGNORECASE)
+# trips already present as a FROM or JOIN source, in any case
+TRIPS_SOURCE_RE = re.compile(r'\b(?:FROM|JOIN)\s+trips\b', re.IGNORECASE)
+# The non-existent last_active_date column, and WHERE/AND clauses built on it
+LAST_ACTIVE_DATE_RE = re.compile(r'\blast_active_date\b', re.IGNORECASE)
+LAST_ACTIVE_CLAUSE_RE = re.compile(r'(WHERE|AND)\b[^()]*\blast_active[^()]*\b(AND|\)|$)', re.IGNORECASE)
+# What last_active_date is replaced with: the vehicle's latest trip start
+LAST_ACTIVE_REPLACEMENT = "(SELECT MAX(trips.start_ts) FROM trips WHERE trips.vehicle_id = vehicles.vehicle_id)"
+# A FROM vehicles clause without a JOIN, up to the next clause keyword
+FROM_VEHICLES_RE = re.compile(r'FROM\s+vehicles\b([^J]*)(WHERE|GROUP|ORDER|HAVING|LIMIT|$)', re.IGNORECASE)
+# A complete, guarded SELECT inside otherwise unparseable LLM output
+AGGRESSIVE_SELECT_RE = re.compile(r"SELECT\s+.+?WHERE.+?fleet_id\s*=\s*:fleet_id.+?LIMIT\s+\d+", re.IGNORECASE | re.DOTALL)
+
 def check_sql_content(sql_text, error_message):
     """Helper function to check if SQL content is valid."""
     if not sql_text:
-        print(error_message)
+        logger.warning(error_message)
         raise ValueError(error_message)
 
 def is_valid_sql(sql_text):
     """Check if text contains valid SQL elements."""
-    return "SELECT" in sql_text.upper()
+    return SELECT_RE.search(sql_text) is not None
 
 def correct_active_conditions(extracted_sql: str) -> str:
     """
@@ -36,36 +54,25 @@ def correct_active_conditions(extracted_sql: str) -> str:
         Corrected SQL query
     """
     # Delegate the complexity to the active_conditions module
-    from sql_assistant.services.active_conditions import process_active_conditions
-    
     # Process all active conditions correction in one call
     return process_active_conditions(extracted_sql)
 
 def _replace_direct_last_active_date(extracted_sql: str) -> str:
     """Replace direct last_active_date column references."""
-    last_active_replacement = "(SELECT MAX(trips.start_ts) FROM trips WHERE trips.vehicle_id = vehicles.vehicle_id)"
-    
     # Replace all instances of last_active_date with the subquery
-    extracted_sql = re.sub(
-        r'\blast_active_date\b',
-        last_active_replacement,
-        extracted_sql,
-        flags=re.IGNORECASE
-    )
-    
-    print("🔄 After last_active_date replacement: " + extracted_sql[:150] + "...")
+    extracted_sql = LAST_ACTIVE_DATE_RE.sub(LAST_ACTIVE_REPLACEMENT, extracted_sql)
+    
+    logger.debug("After last_active_date replacement: %.150s...", extracted_sql)
     return extracted_sql
 
 def _determine_replacement_text(match_text: str) -> str:
     """Determine the appropriate replacement text based on context."""
-    last_active_replacement = "(SELECT MAX(trips.start_ts) FROM trips WHERE trips.vehicle_id = vehicles.vehicle_id)"
-    
     if "MONTH" in match_text.upper() and "EXTRACT" in match_text.upper():
         # If checking for same month, replace with activity check
         return ACTIVE_VEHICLES_SQL_PATTERN
     else:
         # Just use direct last_active_date replacement
-        return last_active_replacement
+        return LAST_ACTIVE_REPLACEMENT
 
 def _build_replacement_clause(match, replacement_text: str) -> str:
     """Build the replacement clause based on WHERE/AND context."""
@@ -82,14 +89,13 @@ def _build_replacement_clause(match, replacement_text: str) -> str:
 
 def _handle_last_active_clause(extracted_sql: str) -> str:
     """Handle complex last_active clause replacements."""
-    print("⚠️ Found 'last_active_date' keyword but no direct match with exact column name")
-    last_active_clause_pattern = r'(WHERE|AND)\b[^()]*\blast_active[^()]*\b(AND|\)|$)'
-    match = re.search(last_active_clause_pattern, extracted_sql, re.IGNORECASE)
+    logger.debug("Found 'last_active_date' keyword but no direct match with exact column name")
+    match = LAST_ACTIVE_CLAUSE_RE.search(extracted_sql)
     
     if not match:
         return extracted_sql
     
-    print(f"🔄 Found last_active clause: {match.group(0)}")
+    logger.debug("Found last_active clause: %s", match.group(0))
     
     # Determine replacement text based on context
     replacement_text = _determine_replacement_text(match.group(0))
@@ -99,7 +105,7 @@ def _handle_last_active_clause(extracted_sql: str) -> str:
     
     # Apply the replacement
     extracted_sql = extracted_sql[:match.start()] + replacement + extracted_sql[match.end():]
-    print("🔄 After last_active clause replacement: " + extracted_sql[:150] + "...")
+    logger.debug("After last_active clause replacement: %.150s...", extracted_sql)
     
     return extracted_sql
 
@@ -117,11 +123,10 @@ def correct_last_active_date(extracted_sql: str) -> str:
     if "last_active_date" not in extracted_sql.lower():
         return extracted_sql
     
-    last_active_pattern = r'\blast_active_date\b'
-    match = re.search(last_active_pattern, extracted_sql, re.IGNORECASE)
+    match = LAST_ACTIVE_DATE_RE.search(extracted_sql)
     
     if match:
-        print(f"🔄 Found non-existent 'last_active_date' column usage: {match.group(0)}")
+        logger.debug("Found non-existent 'last_active_date' column usage: %s", match.group(0))
         return _replace_direct_last_active_date(extracted_sql)
     else:
         return _handle_last_active_clause(extracted_sql)
@@ -139,24 +144,21 @@ def ensure_trips_join(extracted_sql: str) -> str:
     # Check if we need to add trips JOIN
     needs_join = (("vehicle_id IN (SELECT DISTINCT trips.vehicle_id" in extracted_sql or 
                   "MAX(trips.start_ts)" in extracted_sql) and 
-                  "JOIN trips" not in extracted_sql.upper() and 
-                  "FROM trips" not in extracted_sql.upper())
+                  not TRIPS_SOURCE_RE.search(extracted_sql))
     
     if not needs_join:
         return extracted_sql
     
-    print("🔄 Added missing JOIN with trips table")
+    logger.debug("Adding missing JOIN with trips table")
     
     # Add trips JOIN to FROM clause if needed
     if "FROM vehicles" in extracted_sql:
-        extracted_sql = re.sub(
-            r'FROM\s+vehicles\b([^J]*)(WHERE|GROUP|ORDER|HAVING|LIMIT|$)',
+        extracted_sql = FROM_VEHICLES_RE.sub(
             r'FROM vehicles LEFT JOIN trips ON vehicles.vehicle_id = trips.vehicle_id\1\2',
-            extracted_sql,
-            flags=re.IGNORECASE
+            extracted_sql
         )
     
-    print("🔄 After JOIN addition: " + extracted_sql[:150] + "...")
+    logger.debug("After JOIN addition: %.150s...", extracted_sql)
     return extracted_sql
 
 def attempt_aggressive_extraction(sql: str) -> Tuple[bool, str]:
@@ -170,14 +172,13 @@ def attempt_aggressive_extraction(sql: str) -> Tuple[bool, str]:
         Tuple of (success, extracted_sql)
     """
     contains_code_block = '```' in sql
-    contains_select = "SELECT" in sql.upper()
+    contains_select = SELECT_RE.search(sql) is not None
     
     if not (contains_code_block or contains_select):
         return False, ""
     
-    print("Attempting more aggressive SQL extraction...")
-    select_pattern = r"SELECT\s+.+?WHERE.+?fleet_id\s*=\s*:fleet_id.+?LIMIT\s+\d+"
-    select_match = re.search(select_pattern, sql, re.IGNORECASE | re.DOTALL)
+    logger.debug("Attempting more aggressive SQL extraction")
+    select_match = AGGRESSIVE_SELECT_RE.search(sql)
     
     if not select_match:
         return False, ""
@@ -186,7 +187,7 @@ def attempt_aggressive_extraction(sql: str) -> Tuple[bool, str]:
     is_valid2, _ = validate_sql(extracted_try2)
     
     if is_valid2:
-        print("✅ Second extraction attempt successful")
+        logger.debug("Second extraction attempt successful")
         return True, extracted_try2
     
     return False, ""
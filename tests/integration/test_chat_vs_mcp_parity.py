@@ -36,10 +36,10 @@ async def test_chat_vs_mcp_parity():
              patch('sql_assistant.main.llm_nl_to_sql') as mock_llm_nl_to_sql, \
              patch('sql_assistant.main.sql_exec') as mock_sql_exec, \
              patch('sql_assistant.main.answer_format') as mock_answer_format, \
-             patch('sql_assistant.services.pipeline.check_llm_api_keys') as mock_check_keys:
+             patch('sql_assistant.services.pipeline.get_available_llm_providers') as mock_providers:
             
             # Mock the API key check to avoid LLM calls
-            mock_check_keys.return_value = ("dummy_key", None, None)
+            mock_providers.return_value = ("openai",)
             
             # Set consistent mock return values for both endpoints
             test_sql = "SELECT * FROM test"
@@ -107,10 +107,10 @@ async def test_mcp_partial_steps():
         with patch('sql_assistant.main.llm_nl_to_sql') as mock_llm_nl_to_sql, \
              patch('sql_assistant.main.sql_exec') as mock_sql_exec, \
              patch('sql_assistant.main.answer_format') as mock_answer_format, \
-             patch('sql_assistant.services.pipeline.check_llm_api_keys') as mock_check_keys:
+             patch('sql_assistant.services.pipeline.get_available_llm_providers') as mock_providers:
             
             # Mock the API key check to avoid LLM calls
-            mock_check_keys.return_value = ("dummy_key", None, None)
+            mock_providers.return_value = ("openai",)
             
             # Set up mock return values
             mock_llm_nl_to_sql.return_value = {"sql": "SELECT * FROM test"}
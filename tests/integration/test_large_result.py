@@ -33,10 +33,10 @@ async def test_large_result_path():
     """Test that queries returning >100 rows provide a download_url and create the file."""
     # Mock the process_query function directly to avoid DB access issues and LLM providers
     with patch('sql_assistant.main.process_query') as mock_process, \
-         patch('sql_assistant.services.pipeline.check_llm_api_keys') as mock_check_keys:
+         patch('sql_assistant.services.pipeline.get_available_llm_providers') as mock_providers:
         
         # Mock the API key check to avoid LLM calls
-        mock_check_keys.return_value = ("dummy_key", None, None)
+        mock_providers.return_value = ("openai",)
         
         # Generate a unique filename for testing
         test_filename = f"{uuid.uuid4()}.csv"
@@ -97,10 +97,10 @@ async def test_small_result_path():
     """Test that queries returning ≤100 rows provide rows directly and not download_url."""
     # Mock the process_query function to return a small result set and LLM providers
     with patch('sql_assistant.main.process_query') as mock_process, \
-         patch('sql_assistant.services.pipeline.check_llm_api_keys') as mock_check_keys:
+         patch('sql_assistant.services.pipeline.get_available_llm_providers') as mock_providers:
         
         # Mock the API key check to avoid LLM calls
-        mock_check_keys.return_value = ("dummy_key", None, None)
+        mock_providers.return_value = ("openai",)
         
         # Set up mock return values for a small result set
         mock_rows = [{"id": i, "value": f"test{i}"} for i in range(10)]
@@ -0,0 +1,64 @@
+"""
+Unit tests for batch query processing.
+
+Tests the OpenAI batch file format and the real-time fallback path.
+"""
+import json
+import os
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from sql_assistant.services.batch import (
+    build_batch_requests,
+    parse_batch_output,
+    process_queries_batch,
+)
+from sql_assistant.services.pipeline import ANSWER_MAX_TOKENS
+
+
+def test_batch_requests_round_trip_custom_ids():
+    """Test that each context becomes one chat request keyed by its index."""
+    lines = build_batch_requests(["ctx a", "ctx b"]).decode("utf-8").splitlines()
+    requests = [json.loads(line) for line in lines]
+    assert [r["custom_id"] for r in requests] == ["0", "1"]
+    assert "ctx b" in requests[1]["body"]["messages"][-1]["content"]
+    assert requests[0]["body"]["max_tokens"] == ANSWER_MAX_TOKENS
+
+    output = "\n".join(json.dumps({
+        "custom_id": r["custom_id"],
+        "response": {"status_code": 200, "body": {"choices": [{"message": {"content": f" answer {r['custom_id']} "}}]}}
+    }) for r in requests)
+    assert parse_batch_output(output) == {"0": "answer 0", "1": "answer 1"}
+
+
+@pytest.mark.asyncio
+async def test_without_openai_key_answers_in_real_time():
+    """Test that answers fall back to answer_format when no batch is submitted."""
+    with patch.dict(os.environ, {"OPENAI_API_KEY": ""}), \
+         patch('sql_assistant.services.batch.llm_nl_to_sql', new_callable=AsyncMock) as mock_nl, \
+         patch('sql_assistant.services.batch.sql_exec', new_callable=AsyncMock) as mock_exec, \
+         patch('sql_assistant.services.batch.answer_format', new_callable=AsyncMock) as mock_answer:
+        mock_nl.return_value = {"sql": "SELECT 1 WHERE fleet_id = :fleet_id"}
+        mock_exec.return_value = {"rows": [{"n": 1}]}
+        mock_answer.return_value = "One."
+        results = await process_queries_batch([("q1", 1), ("q2", 2)])
+    assert [r["answer"] for r in results] == ["One.", "One."]
+    assert mock_answer.call_count == 2
+    assert results[0]["rows"] == [{"n": 1}]
+
+
+@pytest.mark.asyncio
+async def test_invalid_fleet_id_fails_only_its_own_item():
+    """Test that a bad fleet ID is reported for that pair while the rest of the batch runs."""
+    with patch.dict(os.environ, {"OPENAI_API_KEY": ""}), \
+         patch('sql_assistant.services.batch.llm_nl_to_sql', new_callable=AsyncMock) as mock_nl, \
+         patch('sql_assistant.services.batch.sql_exec', new_callable=AsyncMock) as mock_exec, \
+         patch('sql_assistant.services.batch.answer_format', new_callable=AsyncMock) as mock_answer:
+        mock_nl.return_value = {"sql": "SELECT 1 WHERE fleet_id = :fleet_id"}
+        mock_exec.return_value = {"rows": [{"n": 1}]}
+        mock_answer.return_value = "One."
+        results = await process_queries_batch([("q1", "not-a-fleet"), ("q2", 2)])
+    assert results[0]["is_fallback"] is True
+    assert results[1]["rows"] == [{"n": 1}]
+    mock_exec.assert_awaited_once_with("SELECT 1 WHERE fleet_id = :fleet_id", 2)
@@ -0,0 +1,93 @@
+"""
+Unit tests for database operations.
+
+Tests that small results are returned inline and large ones are exported to CSV.
+"""
+import os
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy.dialects.postgresql import asyncpg
+
+from sql_assistant.services import db_operations
+from sql_assistant.services.db_operations import (
+    LARGE_RESULT_THRESHOLD,
+    copy_query_to_csv,
+    stream_sql_query,
+)
+
+
+class _Rows:
+    """Async iterator standing in for a streamed result's mappings()."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._rows)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def _conn_returning(rows):
+    result = MagicMock()
+    result.mappings.return_value = _Rows(rows)
+    result.close = AsyncMock()
+    conn = MagicMock()
+    conn.stream = AsyncMock(return_value=result)
+    return conn
+
+
+@pytest.mark.asyncio
+async def test_small_result_is_returned_inline():
+    """Test that results up to the threshold come back as rows."""
+    rows = [{"n": i} for i in range(LARGE_RESULT_THRESHOLD)]
+    result = await stream_sql_query(_conn_returning(rows), "SELECT n", {})
+    assert result == {"rows": rows}
+
+
+@pytest.mark.asyncio
+async def test_large_result_is_exported_with_copy(tmp_path):
+    """Test that results over the threshold are exported with COPY instead of fetched."""
+    rows = [{"n": i} for i in range(LARGE_RESULT_THRESHOLD + 50)]
+    conn = _conn_returning(rows)
+    conn.dialect = asyncpg.dialect()
+    driver = MagicMock()
+    driver.copy_from_query = AsyncMock(return_value="COPY 1234")
+    conn.get_raw_connection = AsyncMock(return_value=MagicMock(driver_connection=driver))
+    with patch.object(db_operations, "STATIC_DIR", str(tmp_path)):
+        result = await stream_sql_query(conn, "SELECT n FROM t WHERE fleet_id = :fleet_id", {"fleet_id": 7})
+    assert result["rows"] == []
+    assert result["row_count"] == 1234
+    conn.stream.return_value.close.assert_awaited_once()
+    args, kwargs = driver.copy_from_query.call_args
+    assert args == ("SELECT n FROM t WHERE fleet_id = $1", 7)
+    assert kwargs["format"] == "csv" and kwargs["header"] is True
+    assert kwargs["output"] == os.path.join(str(tmp_path), result["download_url"].rsplit("/", 1)[-1])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sql, expected_sql, expected_args", [
+    (
+        "SELECT * FROM trips WHERE fleet_id = :fleet_id LIMIT 500",
+        "SELECT * FROM trips WHERE fleet_id = $1 LIMIT 500",
+        (7,)
+    ),
+    ("SELECT * FROM trips LIMIT 500", "SELECT * FROM trips LIMIT 500", ()),
+])
+async def test_copy_binds_only_parameters_the_sql_uses(tmp_path, sql, expected_sql, expected_args):
+    """Test that COPY compiles against the asyncpg dialect with and without :fleet_id."""
+    conn = MagicMock()
+    conn.dialect = asyncpg.dialect()
+    driver = MagicMock()
+    driver.copy_from_query = AsyncMock(return_value="COPY 500")
+    conn.get_raw_connection = AsyncMock(return_value=MagicMock(driver_connection=driver))
+    with patch.object(db_operations, "STATIC_DIR", str(tmp_path)):
+        result = await copy_query_to_csv(conn, sql, {"fleet_id": 7})
+    assert result["row_count"] == 500
+    args, _ = driver.copy_from_query.call_args
+    assert args == (expected_sql, *expected_args)
@@ -0,0 +1,42 @@
+"""
+Unit tests for LLM response caching.
+
+Tests expiry and eviction in the in-process TTL cache.
+"""
+from unittest.mock import patch
+
+from sql_assistant.services.llm_cache import TTLCache, hash_key, normalize_query
+
+
+def test_least_recently_used_entry_is_evicted():
+    """Test that the oldest untouched entry is dropped when the cache is full."""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_entries_expire_after_ttl():
+    """Test that entries are not returned once their time-to-live has passed."""
+    cache = TTLCache(maxsize=2, ttl=10)
+    with patch('sql_assistant.services.llm_cache.time.monotonic', return_value=100.0):
+        cache.set("a", 1)
+    with patch('sql_assistant.services.llm_cache.time.monotonic', return_value=111.0):
+        assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_hash_key_separates_parts():
+    """Test that different splits of the same text produce different keys."""
+    assert hash_key("ab", "c") != hash_key("a", "bc")
+    assert hash_key("ab", "c") == hash_key("ab", "c")
+
+
+def test_normalize_query_ignores_spacing_and_trailing_punctuation():
+    """Test that trivially different phrasings share a key but case is preserved."""
+    assert normalize_query("  How many   trips? ") == normalize_query("How many trips")
+    assert normalize_query("SRM T3 vehicles") != normalize_query("srm t3 vehicles")
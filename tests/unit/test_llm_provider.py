@@ -0,0 +1,91 @@
+"""
+Unit tests for LLM provider utilities.
+
+Tests the retry policy and timeout applied to provider API calls.
+"""
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from sql_assistant.services.llm_provider import (
+    LLM_MAX_RETRIES,
+    LLM_RETRY_AFTER_MAX,
+    LLMTimeoutError,
+    call_provider,
+    call_with_retries,
+)
+
+
+class FakeStatusError(Exception):
+    """Stand-in for an SDK error carrying an HTTP status code."""
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+@pytest.mark.asyncio
+async def test_retries_transient_status_then_succeeds():
+    """Test that a 503 is retried and the next successful response is returned."""
+    call = AsyncMock(side_effect=[FakeStatusError(503), "ok"])
+    with patch('sql_assistant.services.llm_provider.asyncio.sleep', new_callable=AsyncMock):
+        result = await call_with_retries(call, model="m")
+    assert result == "ok"
+    assert call.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried():
+    """Test that a non-retriable 4xx error bubbles up immediately."""
+    call = AsyncMock(side_effect=FakeStatusError(400))
+    with patch('sql_assistant.services.llm_provider.asyncio.sleep', new_callable=AsyncMock), \
+         pytest.raises(FakeStatusError):
+        await call_with_retries(call)
+    assert call.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_retries():
+    """Test that persistent rate limiting raises after the retry budget is spent."""
+    call = AsyncMock(side_effect=FakeStatusError(429))
+    with patch('sql_assistant.services.llm_provider.asyncio.sleep', new_callable=AsyncMock), \
+         pytest.raises(FakeStatusError):
+        await call_with_retries(call)
+    assert call.call_count == LLM_MAX_RETRIES + 1
+
+
+class FakeRateLimitError(FakeStatusError):
+    """Stand-in for a 429 carrying a Retry-After header."""
+    def __init__(self, retry_after):
+        super().__init__(429)
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)})
+
+
+@pytest.mark.asyncio
+async def test_retry_after_header_is_honoured():
+    """Test that a short Retry-After sets the backoff delay."""
+    call = AsyncMock(side_effect=[FakeRateLimitError(2), "ok"])
+    with patch('sql_assistant.services.llm_provider.asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+        assert await call_with_retries(call) == "ok"
+    assert mock_sleep.call_args[0][0] >= 2
+
+
+@pytest.mark.asyncio
+async def test_long_retry_after_fails_over_immediately():
+    """Test that a Retry-After beyond the cap raises instead of waiting."""
+    call = AsyncMock(side_effect=FakeRateLimitError(LLM_RETRY_AFTER_MAX + 30))
+    with pytest.raises(FakeRateLimitError):
+        await call_with_retries(call)
+    assert call.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_provider_call_times_out():
+    """Test that a provider call over the request budget raises LLMTimeoutError."""
+    async def slow_call():
+        await asyncio.sleep(1)
+
+    with patch('sql_assistant.services.llm_provider.LLM_REQUEST_TIMEOUT', 0.01), \
+         pytest.raises(LLMTimeoutError):
+        await call_provider("openai", slow_call)
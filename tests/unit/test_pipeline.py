@@ -0,0 +1,205 @@
+"""
+Unit tests for the query pipeline.
+
+Tests request coordination in process_query, caching of generated SQL, the
+concurrent fallback query, answer hedging, answer streaming and canned SQL.
+"""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from sql_assistant.guardrails import validate_sql
+from sql_assistant.services.llm_cache import answer_cache, sql_cache
+from sql_assistant.services.pipeline import (
+    ANSWER_CONTEXT_REMINDER,
+    InvalidColumnError,
+    _first_successful_answer,
+    _generate_fallback_response,
+    _inflight_queries,
+    _llm_nl_to_sql,
+    _prepare_answer_context,
+    _sql_exec_with_fallback,
+    llm_nl_to_sql,
+    process_query,
+    process_query_stream,
+)
+
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_queries_share_one_run():
+    """Test that concurrent identical requests run the pipeline once."""
+    calls = []
+
+    async def fake_process_query(query, fleet_id, strategy):
+        calls.append((query, fleet_id))
+        await asyncio.sleep(0.01)
+        return {"answer": f"fleet {fleet_id}"}
+
+    with patch('sql_assistant.services.pipeline._process_query', fake_process_query):
+        first, second, other_fleet = await asyncio.gather(
+            process_query("How many trips?", 1),
+            process_query("How many trips?", 1),
+            process_query("How many trips?", 2)
+        )
+    assert len(calls) == 2
+    assert first == second == {"answer": "fleet 1"}
+    assert other_fleet == {"answer": "fleet 2"}
+    assert not _inflight_queries
+
+
+@pytest.mark.asyncio
+async def test_generated_sql_is_cached_per_provider_and_query():
+    """Test that a repeated query reuses the SQL instead of calling the provider again."""
+    sql_cache.clear()
+    with patch('sql_assistant.services.pipeline._request_sql', new_callable=AsyncMock) as mock_request:
+        mock_request.return_value = {"sql": "SELECT 1", "prompt": "p"}
+        first = await _llm_nl_to_sql("openai", "How many trips?", model="gpt-4")
+        second = await _llm_nl_to_sql("openai", "How many trips?", model="gpt-4")
+        await _llm_nl_to_sql("deepseek", "How many trips?", model="deepseek-chat")
+    assert first == second == {"sql": "SELECT 1", "prompt": "p"}
+    assert mock_request.call_count == 2
+    sql_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_sql_with_unknown_columns_is_not_cached():
+    """Test that rejected SQL is not replayed from the cache on the next request."""
+    sql_cache.clear()
+    bad = {"sql": "SELECT vehicles.last_active_date FROM vehicles WHERE fleet_id = :fleet_id", "prompt": "p"}
+    good = {"sql": "SELECT vehicles.model FROM vehicles WHERE fleet_id = :fleet_id", "prompt": "p"}
+    with patch('sql_assistant.services.pipeline._request_sql', new_callable=AsyncMock) as mock_request:
+        mock_request.side_effect = [bad, good]
+        with pytest.raises(InvalidColumnError):
+            await _llm_nl_to_sql("openai", "Which models do we run?", model="gpt-4")
+        result = await _llm_nl_to_sql("openai", "Which models do we run?", model="gpt-4")
+    assert result == good
+    assert mock_request.call_count == 2
+    sql_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_fallback_query_runs_alongside_empty_primary_query():
+    """Test that strict mode attaches the fallback result only when the primary query is empty."""
+    fallback = {"rows": [{"vehicle_id": 1}], "is_fallback": True}
+    with patch('sql_assistant.services.pipeline.sql_exec', new_callable=AsyncMock) as mock_exec, \
+         patch('sql_assistant.services.pipeline._try_fallback_query', new_callable=AsyncMock) as mock_fallback:
+        mock_fallback.return_value = fallback
+        mock_exec.return_value = {"rows": [], "is_empty_result": True, "query_context": {"fleet_id": 1}}
+        empty = await _sql_exec_with_fallback("q", "SELECT 1", 1, "strict")
+        mock_exec.return_value = {"rows": [{"n": 1}], "row_count": 1, "is_empty_result": False}
+        found = await _sql_exec_with_fallback("q", "SELECT 1", 1, "strict")
+        base = await _sql_exec_with_fallback("q", "SELECT 1", 1, "base")
+    assert empty["fallback_result"] == fallback
+    assert "fallback_result" not in found
+    assert "fallback_result" not in base
+    assert mock_fallback.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_answer_is_streamed_then_returned_with_metadata():
+    """Test that answer text arrives as deltas followed by the full result."""
+    async def fake_stream(context_str, provider, messages=None):
+        for text in ("There are ", "3 trips."):
+            yield text
+
+    answer_cache.clear()
+    with patch('sql_assistant.services.pipeline.llm_nl_to_sql', new_callable=AsyncMock) as mock_nl, \
+         patch('sql_assistant.services.pipeline._sql_exec_with_fallback', new_callable=AsyncMock) as mock_exec, \
+         patch('sql_assistant.services.pipeline._provider_order', return_value=["openai"]), \
+         patch('sql_assistant.services.pipeline.llm_answer_format_stream', fake_stream):
+        mock_nl.return_value = {"sql": "SELECT COUNT(*) FROM trips WHERE fleet_id = :fleet_id LIMIT 1", "prompt": "p"}
+        mock_exec.return_value = {"rows": [{"count": 3}], "row_count": 1, "is_empty_result": False}
+        events = [event async for event in process_query_stream("How many trips?", 1)]
+    answer_cache.clear()
+    assert [e["text"] for e in events[:-1]] == ["There are ", "3 trips."]
+    result = events[-1]
+    assert result["type"] == "result"
+    assert result["answer"].startswith("There are 3 trips.")
+    assert result["rows"] == [{"count": 3}]
+    assert result["is_fallback"] is False
+
+
+def test_failed_query_context_is_lean():
+    """Test that error contexts drop the full reminder and truncate long errors."""
+    error = "UndefinedColumnError: column trips.energy does not exist\n" + "Traceback line\n" * 200
+    failed = _prepare_answer_context("How much energy?", {"rows": [], "error": error}, "SELECT 1", fleet_id=1)
+    succeeded = _prepare_answer_context("How much energy?", {"rows": [{"kwh": 3}]}, "SELECT 1", fleet_id=1)
+    assert "column trips.energy does not exist" in failed
+    assert len(failed) < len(error)
+    assert ANSWER_CONTEXT_REMINDER not in failed
+    assert succeeded.endswith(ANSWER_CONTEXT_REMINDER)
+
+
+def test_fallback_response_reads_prepared_answer_context():
+    """Test that the canned fallback answer is built from an answer context string."""
+    context = _prepare_answer_context("How many trips?", {"rows": [], "error": "timeout"}, "SELECT 1", fleet_id=1)
+    answer = _generate_fallback_response(context)
+    assert answer.startswith("I understand you're asking about How many trips?.")
+    assert "simpler parts" in answer
+
+
+@pytest.mark.asyncio
+async def test_answer_request_is_hedged_only_when_primary_is_slow():
+    """Test that backup providers are asked only after the primary exceeds the hedge delay."""
+    calls = []
+
+    async def fake_answer(context_str, provider, messages=None):
+        calls.append(provider)
+        await asyncio.sleep(0.2 if provider == "openai" and "slow" in context_str else 0)
+        return f"{provider} answer"
+
+    answer_cache.clear()
+    with patch('sql_assistant.services.pipeline.llm_answer_format', fake_answer), \
+         patch('sql_assistant.services.pipeline.HEDGE_DELAY', 0.05):
+        fast = await _first_successful_answer("fast context", ["openai", "anthropic"])
+        fast_calls = list(calls)
+        slow = await _first_successful_answer("slow context", ["openai", "anthropic"])
+    answer_cache.clear()
+    assert fast == "openai answer"
+    assert fast_calls == ["openai"]
+    assert slow == "anthropic answer"
+    assert calls[1:] == ["openai", "anthropic"]
+
+
+@pytest.mark.asyncio
+async def test_sql_generation_fails_over_to_next_provider():
+    """Test that SQL comes from a backup provider when the primary one fails."""
+    async def fake_nl_to_sql(provider, query, model=None):
+        if provider == "openai":
+            raise RuntimeError("rate limited")
+        return {"sql": f"SELECT 1 -- {provider}", "prompt": "p"}
+
+    with patch('sql_assistant.services.pipeline._llm_nl_to_sql', fake_nl_to_sql), \
+         patch('sql_assistant.services.pipeline._provider_order', return_value=["openai", "mistral"]):
+        result = await llm_nl_to_sql("How many trips?")
+    assert result["sql"] == "SELECT 1 -- mistral"
+
+
+@pytest.mark.asyncio
+async def test_sql_with_unknown_columns_fails_over_to_next_provider():
+    """Test that SQL referencing columns missing from the schema is not returned."""
+    async def fake_request_sql(provider, query, model):
+        if provider == "openai":
+            return {"sql": "SELECT vehicles.last_active_date FROM vehicles WHERE fleet_id = :fleet_id", "prompt": "p"}
+        return {"sql": "SELECT vehicles.model FROM vehicles WHERE fleet_id = :fleet_id", "prompt": "p"}
+
+    sql_cache.clear()
+    with patch('sql_assistant.services.pipeline._request_sql', fake_request_sql), \
+         patch('sql_assistant.services.pipeline._provider_order', return_value=["openai", "mistral"]):
+        result = await llm_nl_to_sql("Which models do we run?")
+    assert result["sql"] == "SELECT vehicles.model FROM vehicles WHERE fleet_id = :fleet_id"
+    sql_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_recurring_question_uses_canned_sql_without_llm():
+    """Test that canned SQL is returned for a recurring question and is guardrail-valid."""
+    with patch('sql_assistant.services.pipeline._llm_nl_to_sql', new_callable=AsyncMock) as mock_nl, \
+         patch('sql_assistant.services.pipeline._provider_order', return_value=["openai"]):
+        mock_nl.return_value = {"sql": "SELECT 1", "prompt": "p"}
+        result = await llm_nl_to_sql("How many  vehicles are active this month?")
+        assert validate_sql(result["sql"]) == (True, "")
+        mock_nl.assert_not_called()
+        await llm_nl_to_sql("How many SRM T3 vans are active this month?")
+        mock_nl.assert_called()
@@ -0,0 +1,57 @@
+"""
+Unit tests for SQL post-processing in the pipeline.
+
+Tests the schema checks and corrections applied to LLM-generated SQL.
+"""
+from sql_assistant.services.pipeline import (
+    _correct_invalid_columns,
+    _fix_duplicate_limits,
+    find_unknown_columns,
+)
+from sql_assistant.services.sql_correction import ensure_trips_join
+
+
+def test_unknown_column_resolved_through_alias():
+    """Test that alias-qualified columns are checked against the aliased table."""
+    sql = (
+        "SELECT v.vehicle_id, SUM(t.energy) FROM vehicles v "
+        "JOIN trips t ON v.vehicle_id = t.vehicle_id WHERE v.fleet_id = :fleet_id"
+    )
+    assert find_unknown_columns(sql) == ["t.energy"]
+
+
+def test_known_columns_pass():
+    """Test that valid table-qualified columns and string literals are not flagged."""
+    sql = (
+        "SELECT vehicles.vin, trips.start_ts::date FROM vehicles "
+        "LEFT JOIN trips ON vehicles.vehicle_id = trips.vehicle_id "
+        "WHERE vehicles.fleet_id = :fleet_id AND vehicles.model = 'SRM.T3'"
+    )
+    assert find_unknown_columns(sql) == []
+
+
+def test_subquery_aliases_are_not_checked():
+    """Test that qualifiers that are not tables or table aliases are ignored."""
+    sql = "SELECT s.total FROM (SELECT COUNT(*) AS total FROM trips) s WHERE fleet_id = :fleet_id"
+    assert find_unknown_columns(sql) == []
+
+
+def test_duplicate_limits_keep_first_without_mangling_others():
+    """Test that removing a short LIMIT does not eat the prefix of a longer one."""
+    sql = "SELECT * FROM trips WHERE fleet_id = :fleet_id LIMIT 5 LIMIT 5000"
+    assert _fix_duplicate_limits(sql) == "SELECT * FROM trips WHERE fleet_id = :fleet_id LIMIT 5"
+
+
+def test_trips_energy_correction_leaves_energy_kwh_alone():
+    """Test that only the bare trips.energy column is rewritten."""
+    sql = "SELECT trips.energy, trips.energy_kwh FROM trips"
+    assert _correct_invalid_columns(sql) == "SELECT trips.energy_kwh, trips.energy_kwh FROM trips"
+
+
+def test_trips_join_not_added_when_trips_already_queried():
+    """Test that a subquery over trips does not get an extra JOIN on the outer query."""
+    sql = (
+        "SELECT COUNT(*) FROM vehicles WHERE fleet_id = :fleet_id AND vehicles.vehicle_id IN "
+        "(SELECT DISTINCT trips.vehicle_id FROM trips) LIMIT 5000"
+    )
+    assert ensure_trips_join(sql) == sql